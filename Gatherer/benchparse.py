@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+#
+# Check and time fetchpages.parse against the pages in ./corpus.
+#
+# The corpus is built from the page samples in fetchpages.py: one page in the current
+# format, one in the older format (with a footnoted sailing), and one with no sailings.
+# expected.txt holds the times each page should parse to; add to both as new page
+# formats turn up.
+#
+import os
+import sys
+import timeit
+import logging
+import fetchpages
+
+corpusdir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+fetchpages.logger.setLevel(logging.ERROR)
+
+def loadcorpus():
+    """Return a list of (name, page text, expected times) for the corpus"""
+    corpus = []
+    with open(os.path.join(corpusdir, "expected.txt")) as f:
+        for line in f:
+            fields = line.split()
+            if fields and not line.startswith("#"):
+                name = fields[0]
+                expected = fields[1] if len(fields) > 1 else ""
+                with open(os.path.join(corpusdir, name)) as page:
+                    corpus.append( (name, page.read(), expected) )
+    return corpus
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    ok = True
+    for (name, text, expected) in loadcorpus():
+        result = fetchpages.parse(text)
+        if result != expected:
+            print "{0}: FAILED, got '{1}'".format(name, result)
+            ok = False
+            continue
+        usec = min(timeit.repeat(lambda: fetchpages.parse(text), number=repeat, repeat=3)) / repeat * 1e6
+        print "{0:<24} {1:8.1f} usec/page".format(name, usec)
+    if not ok:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
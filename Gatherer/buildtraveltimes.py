@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+#
+# Build the offline drive time table used by the server when MapQuest is unavailable
+# (see Server2/DriveTable.py).
+#
+# We ask MapQuest for the travel times from every point of a lat/lon grid over Puget Sound,
+# filtered exactly as the server filters live results.  That is a lot of calls (several
+# thousand with the default grid), so this is something to run rarely, and slowly.
+#
+import os
+import sys
+import time
+import logging
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Server2"))
+import WSF
+import MapQuestTT
+import Breaker
+import DriveTable
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+logger.addHandler(logging.StreamHandler())
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--out", help="Where to write the table", default=DriveTable.DefaultPath)
+parser.add_argument("--lat0", type=float, default=47.0, help="Southern edge of the grid")
+parser.add_argument("--lon0", type=float, default=-123.2, help="Western edge of the grid")
+parser.add_argument("--lat1", type=float, default=48.9, help="Northern edge of the grid")
+parser.add_argument("--lon1", type=float, default=-121.9, help="Eastern edge of the grid")
+parser.add_argument("--step", type=float, default=0.02, help="Grid spacing in degrees")
+parser.add_argument("--delay", type=float, default=0.5, help="Seconds to wait between MapQuest calls")
+
+
+def query(lat, lon):
+    """Ask MapQuest for the travel times from (lat,lon), waiting out the breaker if it is open"""
+    while True:
+        try:
+            return MapQuestTT.queryTravelTimes(lat, lon)
+        except MapQuestTT.Refused as e:
+            logger.warn("%s; waiting %d seconds", e, MapQuestTT.guard.cooldown)
+            time.sleep(MapQuestTT.guard.cooldown)
+
+
+def celltimes(lat, lon, codes):
+    """Return the minutes from (lat,lon) to each terminal in codes (DriveTable.Missing if not reachable)"""
+    times = dict( (c, DriveTable.Missing) for c in codes )
+    try:
+        results = query(lat, lon)
+    except Exception as e:
+        # points in the water, etc.
+        logger.warn("No result for %f, %f: %s", lat, lon, repr(e))
+        return [ times[c] for c in codes ]
+    for (term, minutes) in results or ():
+        times[term.code] = min(minutes, DriveTable.Missing - 1)
+    return [ times[c] for c in codes ]
+
+
+def main():
+    args = parser.parse_args()
+    # we pace ourselves with --delay; the server's budget is far too tight for this
+    MapQuestTT.guard = Breaker.breaker(rate=10.0 / max(args.delay, 0.01))
+    nlat = int(round((args.lat1 - args.lat0) / args.step)) + 1
+    nlon = int(round((args.lon1 - args.lon0) / args.step)) + 1
+    codes = [ t.code for t in WSF.Terminals ]
+    logger.info("Building %d x %d grid, %d terminals", nlat, nlon, len(codes))
+
+    cells = []
+    for i in range(nlat):
+        for j in range(nlon):
+            cells.append( celltimes(args.lat0 + i * args.step, args.lon0 + j * args.step, codes) )
+            time.sleep(args.delay)
+        logger.info("Finished row %d of %d", i+1, nlat)
+
+    DriveTable.write(args.out, args.lat0, args.lon0, args.step, nlat, nlon, codes, cells)
+    logger.info("Wrote %s", args.out)
+
+
+if __name__ == '__main__':
+    main()
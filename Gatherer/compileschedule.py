@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+#
+# Compile a schedule gathered by managecaches.py into the file the server loads.
+#
+# Input is a cache_*.txt file (one "schedule(...)," line per route, direction and day).
+# The schedule is checked for completeness and sanity, then written to
+# Server2/schedules/schedule_<mindate>.dat (see Server2/ScheduleFile.py).
+#
+# Usage:
+#   compileschedule.py cache_2017_09_30.txt --mindate 2017-06-30 --name "Summer 2017 (Jun 25, 2017 - Sep 30, 2017)"
+#   compileschedule.py --dump ../Server2/schedules/schedule_2017_06_30.dat
+#
+import os
+import re
+import sys
+import logging
+import argparse
+import datetime
+import fetchpages
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Server2"))
+import ScheduleFile
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.DEBUG)
+logger.addHandler(logging.StreamHandler())
+
+parser = argparse.ArgumentParser()
+parser.add_argument("source", help="cache file to compile, or schedule file to dump")
+parser.add_argument("--mindate", help="first date of the schedule (or date uploaded, if later), as yyyy-mm-dd")
+parser.add_argument("--name", help="name of the schedule, as seen on wsdot.gov")
+parser.add_argument("--out", help="file to write (default: the standard file for mindate)")
+parser.add_argument("--dump", help="print a compiled schedule file in cache file format", action="store_true")
+
+line = re.compile(r"schedule\('([^']+)','([ew])',(\d),'([\d,]*)'\)")
+
+def readcache(path):
+    """Return the entries in a cache file as a list of (name, direction, dow, times)"""
+    entries = []
+    with open(path) as f:
+        for text in f:
+            if not text.strip():
+                continue
+            m = line.match(text.strip())
+            if m is None:
+                raise ValueError("Unrecognized line in {0}: {1}".format(path, text.strip()))
+            (name, direction, dow, times) = m.groups()
+            entries.append( (name, direction, int(dow), [ int(t) for t in times.split(',') if t ]) )
+    return entries
+
+def validate(entries):
+    """Return a list of the problems with a schedule (empty if there are none)"""
+    problems = []
+    expected = set( (name, direction, dow) for (name, a, b, direction) in fetchpages.routes for dow in range(7) )
+    seen = set()
+    for (name, direction, dow, times) in entries:
+        key = (name, direction, dow)
+        if key not in expected:
+            problems.append("unknown route {0}".format(key))
+        if key in seen:
+            problems.append("duplicate route {0}".format(key))
+        seen.add(key)
+        if not times:
+            logger.warning("No sailings for %s", key)
+        if any( b <= a for (a, b) in zip(times, times[1:]) ):
+            problems.append("times out of order for {0}".format(key))
+        if any( t < 0 or t >= 48*60 for t in times ):
+            problems.append("time out of range for {0}".format(key))
+    for key in sorted(expected - seen):
+        problems.append("missing route {0}".format(key))
+    return problems
+
+def dump(path):
+    (mindate, name, entries) = ScheduleFile.read(path)
+    print "# {0:%Y-%m-%d} {1}".format(mindate, name)
+    for (route, direction, dow, times) in entries:
+        print fetchpages.template.format(name=route, direction=direction, dow=dow, times=",".join(map(str,times))),
+
+def main():
+    args = parser.parse_args()
+    if args.dump:
+        dump(args.source)
+        return
+    if not args.mindate or not args.name:
+        parser.error("--mindate and --name are required to compile")
+
+    mindate = datetime.datetime.strptime(args.mindate, "%Y-%m-%d").date()
+    entries = readcache(args.source)
+    problems = validate(entries)
+    if problems:
+        for p in problems:
+            logger.error(p)
+        sys.exit(1)
+
+    out = args.out or ScheduleFile.filename(mindate)
+    ScheduleFile.write(out, mindate, args.name, entries)
+    logger.info("Wrote %d schedules to %s (%d bytes)", len(entries), out, os.stat(out).st_size)
+
+if __name__ == '__main__':
+    main()
@@ -3,10 +3,18 @@
 # Get and parse the pages from the WSDOT site, in particular from it's "mobile"
 # pages, which are much smaller and more succinct than the more general schedules.
 # (Still all the errors that can come from scraping web pages can happen here, of course)
-import urllib2
+import httplib
+import socket
 import re
 import os
+import time
 import logging
+import threading
+import hashlib
+import gzip
+import json
+from array import array
+from multiprocessing.pool import ThreadPool
 
 # The WSDOT ferry routes.  The tuples represent (route name, terminal1, terminal2)
 # The name is our choice.  WSDOT only ever names routes by both
@@ -21,7 +29,9 @@ import logging
 # and Anacortes/Orcas.  Shaw and Lopez are left out, as are all inter-island routes.
 
 # If storepages is set, it must be a path name to a directory in which to put
-# copies of the downloaded pages, for logging/debugging purposes
+# copies of the downloaded pages, for logging/debugging purposes.
+# Pages are stored once per distinct content (see pagedigest), gzipped, as <digest>.html.gz,
+# with index.json recording which digest each (fromterm, toterm, dow) page had.
 storepages = None
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
@@ -76,18 +86,82 @@ routes = [
 #    22: 'Vashon Island'
 #}
 
+# Fetching: each thread keeps its own keep-alive connection to the WSDOT server.
+# Every request has a timeout, and requests that fail in a way that might go away (no
+# connection, a timeout, a 5xx from the server) are retried on a fresh connection, after a
+# delay that doubles each time.  Anything else, such as a 4xx, fails straight away.
+host = "www.wsdot.com"
+timeout = 30        # seconds
+retries = 3
+backoff = 2         # seconds before the first retry
+connections = threading.local()
+
 def fetch(fromterm, toterm, dow):
     """Read the WSDOT web page for this route and return the page as a string.
     fromterm and toterm are terminal identifiers as given above,
     and dow is the day of the week as a capitalized string.
     """
-    uri = "http://www.wsdot.com/Ferries/Schedule/Small/ScheduleDetail.aspx?tripday={0}&departingterm={1}&arrivingterm={2}".format(dow,fromterm,toterm)
-    page = urllib2.urlopen(uri).read()
+    path = "/Ferries/Schedule/Small/ScheduleDetail.aspx?tripday={0}&departingterm={1}&arrivingterm={2}".format(dow,fromterm,toterm)
+    delay = backoff
+    for attempt in range(retries + 1):
+        try:
+            page = get(path)
+            break
+        except Exception as e:
+            closeconnection()
+            if attempt == retries or not transient(e):
+                raise
+            logger.warning("Fetch of %s failed (%s), retrying in %d seconds", path, repr(e), delay)
+            time.sleep(delay)
+            delay *= 2
     logpage(page,fromterm,toterm,dow)
     return page
 
+def get(path):
+    """GET path from host on this thread's connection, and return the body"""
+    conn = getattr(connections, "conn", None)
+    if conn is None:
+        conn = httplib.HTTPConnection(host, timeout=timeout)
+        connections.conn = conn
+    conn.request("GET", path)
+    response = conn.getresponse()
+    body = response.read()
+    if response.status != 200:
+        raise HTTPStatus(response.status, path)
+    return body
+
+class HTTPStatus(IOError):
+    """The server answered with something other than 200"""
+    def __init__(self, status, path):
+        IOError.__init__(self, "HTTP status {0} for {1}".format(status, path))
+        self.status = status
+
+def transient(e):
+    """Return true if a request that failed with e is worth retrying"""
+    if isinstance(e, HTTPStatus):
+        return e.status >= 500
+    return isinstance(e, (socket.error, httplib.HTTPException))
+
+def closeconnection():
+    conn = getattr(connections, "conn", None)
+    if conn is not None:
+        conn.close()
+        connections.conn = None
+
+# A sailing: the time, possibly the date (on after-midnight sailings in the newer format),
+# and possibly a footnote number, as in "8:30 AM (1)" in the older format.
+sailing = re.compile(r"(\d\d?):(\d\d) (A|P)M(?: \[\d\d?/\d\d?/\d\d\d\d\])?(?: \((\d+)\))?")
+# The footnotes themselves, as in ">(1) Priority for Sidney BC vehicles...<"
+footnote = re.compile(r">\((\d+)\) ([^<]+)<")
+
 def parse(text):
-    """Parse the departure times from a WSDOT schedule page."""
+    """Parse the departure times from a WSDOT schedule page, as a comma separated string."""
+    (times, notes) = parsepage(text)
+    return ",".join(map(str,times))
+
+def parsepage(text):
+    """Parse the departure times from a WSDOT schedule page.
+    Returns two parallel arrays: the times, and the footnote number of each sailing (0 if none)."""
     # See a page samples at the bottom of this source file
     # to keep this sort of robust, we don't actually parse the HTML, but just look for
     # the departure times with regular expressions.
@@ -101,58 +175,137 @@ def parse(text):
     # add an extra 24 hours to the reported times after that.
 
     logger.debug("Beginning to parse page")
-    aftermidnight = False
+    midnight = 0    # becomes 24*60 once we are past midnight
     last = 0
-    times = []
-    for m in re.finditer(r"(\d\d?):(\d\d) (A|P)M", text):
-        hours = int(m.group(1))
-        minutes = int(m.group(2))
-        eve = (m.group(3) == 'P')
-        if (hours == 12):
-            hours = 0
-        time = hours * 60 + minutes
-        if (eve):
+    times = array('H')
+    notes = array('B')
+    for m in sailing.finditer(text):
+        (hours, minutes, ampm, note) = m.groups()
+        time = (int(hours) % 12) * 60 + int(minutes)
+        if ampm == 'P':
             time += 12*60
-        if (not aftermidnight and time < last):
-            aftermidnight = True
-        if aftermidnight:
-            time += 24*60
+        if not midnight and time < last:
+            midnight = 24*60
+        time += midnight
         last = time
-        #print "convert " + m.group(0) + " --> " + str(time)
         times.append(time)
-    logger.debug("Parse found %d times from %d to %d", len(times), times[0], times[-1])
-    # return it as a csv string
-    return ",".join(map(str,times))
-
-def allschedules(dofetch=True):
-    """Return all schedules for our tracked WSDOT ferry routes as an array of strings"""
-    result = [];
-    template = "schedule('{name}','{direction}',{dow},'{times}'),\n"
-
-    for (name, terma, termb, direction) in routes:
-        for (dow,dname) in ((0,"Monday"),(1,"Tuesday"),(2,"Wednesday"),
-                            (3,"Thursday"),(4,"Friday"),(5,"Saturday"),(6,"Sunday")):
-            try:
-                logger.info("fetching %s %s %s", name, direction, dname)
-                page = fetch(terma,termb,dname) if dofetch else readpage(terma,termb,dname)
-                times = parse(page)
-                result.append(template.format(name=name,direction=direction,dow=dow,times=times))
-            except Exception as e:
-                logger.exception("Error raised for %s %s %s: %s", name, direction, dname, repr(e))
-    return result
-
+        notes.append(int(note) if note else 0)
+
+    if times:
+        logger.debug("Parse found %d times from %d to %d", len(times), times[0], times[-1])
+    else:
+        logger.warning("Parse found no times")
+    return (times, notes)
+
+def footnotes(text):
+    """Return the footnotes on a schedule page, as a dictionary of number -> text"""
+    return dict( (int(m.group(1)), m.group(2).strip()) for m in footnote.finditer(text) )
+
+days = ((0,"Monday"),(1,"Tuesday"),(2,"Wednesday"),
+        (3,"Thursday"),(4,"Friday"),(5,"Saturday"),(6,"Sunday"))
+template = "schedule('{name}','{direction}',{dow},'{times}'),\n"
+
+def allschedules(dofetch=True, workers=1):
+    """Return all schedules for our tracked WSDOT ferry routes as an array of strings.
+    With workers > 1, that many pages are fetched at once; the result is in the same order either way."""
+    global parsed, shared
+    parsed = {}
+    shared = {}
+    jobs = [ (name, terma, termb, direction, dow, dname, dofetch)
+             for (name, terma, termb, direction) in routes
+             for (dow, dname) in days ]
+    if workers > 1:
+        pool = ThreadPool(workers)
+        try:
+            result = pool.map(oneschedule, jobs)
+        finally:
+            pool.close()
+    else:
+        result = map(oneschedule, jobs)
+    if dofetch:
+        saveindex()
+    logger.info("Parsed %d distinct pages", len(parsed))
+    return [ line for line in result if line is not None ]
+
+def oneschedule(job):
+    """Return the schedule line for one route, direction and day, or None if it could not be had"""
+    (name, terma, termb, direction, dow, dname, dofetch) = job
+    try:
+        logger.info("fetching %s %s %s", name, direction, dname)
+        page = fetch(terma,termb,dname) if dofetch else readpage(terma,termb,dname)
+        digest = pagedigest(page)
+        times = parsed.get(digest)
+        if times is None:
+            (sailings, notes) = parsepage(page)
+            if any(notes):
+                notetext = footnotes(page)
+                for (time, note) in zip(sailings, notes):
+                    if note:
+                        logger.info("%s %s %s: sailing at %d has note (%d) %s",
+                                    name, direction, dname, time, note, notetext.get(note, "?"))
+            times = ",".join(map(str,sailings))
+            parsed[digest] = times
+        with lock:
+            shared.setdefault(digest, []).append( (name, direction, dow) )
+        return template.format(name=name,direction=direction,dow=dow,times=times)
+    except Exception as e:
+        logger.exception("Error raised for %s %s %s: %s", name, direction, dname, repr(e))
+        return None
+
+
+# Most routes have identical pages for several days of the week.  We identify pages by a
+# digest of just the part that carries the schedule (everything after the Alerts link,
+# with the dates that are stamped on after-midnight sailings removed), parse each distinct
+# page once, and remember which route days shared it.
+parsed = {}     # digest -> parsed times
+shared = {}     # digest -> [(name, direction, dow), ...]
+lock = threading.Lock()
+stampedDate = re.compile(r" *\[\d\d?/\d\d?/\d\d\d\d\]")
+
+def pagedigest(text):
+    """Return a digest of the schedule-bearing part of a page"""
+    start = text.find("Alerts</a>")
+    body = text[start:] if start >= 0 else text
+    return hashlib.sha1(stampedDate.sub("", body)).hexdigest()
+
+def identicaldays():
+    """Return the groups of (name, direction, dow) that had identical pages in the last allschedules,
+    as a list of lists.  Only groups with more than one member are included."""
+    return sorted( sorted(days) for days in shared.values() if len(days) > 1 )
+
+
+pageindex = {}  # "fromterm_toterm_dow" -> digest of the stored page
 
 def logpage(text,fromterm,toterm,dow):
     if storepages <> None:
-        filename = "{0}\q{1}_{2}_{3}.html".format(storepages,fromterm,toterm,dow)
-        logger.info("Storing raw file %s", filename)
-        with open(filename,"w") as f:
-            f.write(text)
+        digest = pagedigest(text)
+        filename = os.path.join(storepages, digest + ".html.gz")
+        with lock:
+            pageindex["{0}_{1}_{2}".format(fromterm,toterm,dow)] = digest
+        if not os.path.exists(filename):
+            logger.info("Storing raw file %s", filename)
+            with gzip.open(filename,"wb") as f:
+                f.write(text)
+
+def saveindex():
+    if storepages <> None:
+        with open(os.path.join(storepages, "index.json"),"w") as f:
+            json.dump(pageindex, f, indent=1, sort_keys=True)
 
 def readpage(fromterm,toterm,dow):
-    filename = "{0}\q{1}_{2}_{3}.html".format(storepages,fromterm,toterm,dow)
-    with open(filename,"r") as f:
-        return f.read();
+    if not pageindex:
+        indexfile = os.path.join(storepages, "index.json")
+        if os.path.exists(indexfile):
+            with open(indexfile,"r") as f:
+                pageindex.update(json.load(f))
+    digest = pageindex.get("{0}_{1}_{2}".format(fromterm,toterm,dow))
+    if digest is None:
+        # page stored before we used content addressing
+        filename = "{0}\q{1}_{2}_{3}.html".format(storepages,fromterm,toterm,dow)
+        with open(filename,"r") as f:
+            return f.read();
+    with gzip.open(os.path.join(storepages, digest + ".html.gz"),"rb") as f:
+        return f.read()
 
 
 # page sample
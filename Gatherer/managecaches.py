@@ -17,6 +17,7 @@ import logging
 import stat
 import fetchpages
 import argparse
+import json
 
 cachdir = "D:\\Projects\\NextFerry\\Cache\\"
 fetchpages.storepages = "D:\\Projects\\NextFerry\\Cache\\Raw"
@@ -41,6 +42,7 @@ logger.addHandler(fh)
 parser = argparse.ArgumentParser()
 parser.add_argument("--nofetch", help="Use the currently cached files instead of fetching new files",
     action="store_true")
+parser.add_argument("--workers", help="Number of pages to fetch at once (default 4)", type=int, default=4)
 args = parser.parse_args()
 
 def getwsdotexpiration():
@@ -68,6 +70,11 @@ def install(newschedule, expdate):
     confirm = os.stat(filename)
     logger.info("Created: %s, %d bytes", time.ctime(confirm.st_mtime), confirm.st_size )
 
+    # also record which route days have identical schedules
+    filename = "{}\identical_{:%Y_%m_%d}.json".format(cachdir,expdate)
+    with open(filename,"w") as f:
+        json.dump(fetchpages.identicaldays(), f)
+
 # Main
 # Note that the only exception catching occurs here.  Basically, we don't recover from any
 # errors, we simply note that they occurred and abort.   Since this code needs to
@@ -75,7 +82,7 @@ def install(newschedule, expdate):
 
 def main():
     try:
-        newschedule = fetchpages.allschedules(not args.nofetch)
+        newschedule = fetchpages.allschedules(not args.nofetch, args.workers)
         install(newschedule,getwsdotexpiration())
     except Exception as e:
         logger.exception("Exception raised %s", repr(e))
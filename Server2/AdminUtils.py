@@ -3,6 +3,8 @@ import sys
 import traceback
 import re
 import StringIO
+import Timing
+import MapQuestTT
 from datetime import date, timedelta, datetime
 from google.appengine.api import mail
 from google.appengine.api.logservice import logservice
@@ -40,9 +42,14 @@ def handleError():
 
 
 def mailstats():
-    mailbody = dologs()
+    mailbody = dologs() + "\nLatency (this instance, since the last stats mail):\n" + latencies()
     for recipient in notifylist:
         mail.send_mail("stats@nextferry.appspotmail.com",recipient,"NextFerry Stats",mailbody)
+    Timing.reset()
+    MapQuestTT.upstream.reset()
+
+def latencies():
+    return Timing.stats() + MapQuestTT.upstream.stats("mapquest")
 
 
 # anonymize ip addresses
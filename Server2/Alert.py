@@ -9,6 +9,11 @@ from google.appengine.ext import db
 import WSF
 import pst
 import unicodedata
+import hashlib
+import heapq
+import calendar
+import time
+from google.appengine.api import memcache
 
 class Alert(db.Model):
     body = db.TextProperty()      # alert content
@@ -25,17 +30,118 @@ class Alert(db.Model):
         return "__ %s %d\n%s\n" % (str(localtime), self.routes, self.body)
 
 
-def hasAlerts():
-    return Alert.all().count(limit=1) > 0
-
 def allAlerts():
-    return Alert.all().run(limit=10)
+    # expired alerts stay in the datastore until the daily cleanup; don't let them use up the limit
+    return Alert.all().filter('expires >', dt.datetime.now(pst.utc)).run(limit=10)
+
+DeleteBatch = 500   # the most db.delete takes at once
 
 def dailyCleanup():
     """ Remove all alerts that have expired """
-    for a in db.Query(Alert).filter('expires <',dt.datetime.now(pst.utc)).run():
-        logging.info("deleting " + str(a.posted))
-        a.delete()
+    # Snapshots already leave out expired alerts, so there is no need to tell instances about this.
+    keys = list(db.Query(Alert, keys_only=True).filter('expires <',dt.datetime.now(pst.utc)).run())
+    for i in range(0, len(keys), DeleteBatch):
+        db.delete(keys[i:i+DeleteBatch])
+    logging.info("deleted %d expired alerts", len(keys))
+
+
+# Alerts change a few times a day, but are sent on every /init.  So we keep a snapshot of
+# them, already rendered, and only go back to the datastore when they change.
+# Changes can arrive on any instance, so the signal is a version counter kept in memcache:
+# whoever adds or removes an alert bumps it, and every instance rebuilds when it sees
+# a version different from the one its snapshot was built from.
+# The snapshot is also rebuilt after MaxAge seconds regardless, since the alert query is
+# only eventually consistent and may have missed a just-stored alert.
+# Expired alerts stay in the datastore until the daily cleanup, so the snapshot keeps a heap
+# of expiration times, and when the soonest has passed we make a new snapshot without it.
+
+VersionKey = "alertsversion"
+MaxAge = 300
+
+# Clients may ask only for the alerts on the routes they care about (a mask of route codes,
+# see WSF).  Each alert is rendered once, with its routes, so picking out the ones for a mask
+# is just a scan of the snapshot; the selections for the masks in use are kept as well.
+
+MaxSelections = 64
+
+class snapshot(object):
+    """The current alerts, ready to send"""
+    def __init__(self, version, alerts, built=None):
+        self.version = version  # memcache version this was built from
+        self.built = built or time.time()
+        now = time.time()
+        alerts = [ a for a in alerts if expiration(a) > now ]
+        self.alerts = alerts
+        self.expirations = [ (expiration(a), i) for (i, a) in enumerate(alerts) if a.expires is not None ]
+        heapq.heapify(self.expirations)
+        # alerts are never modified once stored, so their keys are enough to identify them.
+        self.rendered = tuple( (a.routes, str(a.key()), str(a)) for a in alerts )
+        everything = selection(self.rendered)
+        self.text = everything.text
+        self.digest = everything.digest
+        self.selections = { WSF.AllRoutes: everything }   # routes mask -> selection
+
+    def forRoutes(self, mask):
+        """Return the selection of the alerts that affect any of the routes in mask"""
+        found = self.selections.get(mask)
+        if found is None:
+            if len(self.selections) >= MaxSelections:
+                self.selections = { WSF.AllRoutes: self.selections[WSF.AllRoutes] }
+            found = selection( r for r in self.rendered if r[0] & mask )
+            self.selections[mask] = found
+        return found
+
+    def current(self):
+        """Return this snapshot, or if any of its alerts have expired, one without them"""
+        if self.expirations and self.expirations[0][0] <= time.time():
+            return snapshot(self.version, self.alerts, self.built)
+        return self
+
+def expiration(alert):
+    """Return when alert expires, as a timestamp"""
+    if alert.expires is None:
+        return float("inf")
+    return calendar.timegm(alert.expires.utctimetuple())
+
+class selection(object):
+    """Some of the alerts, ready to send"""
+    def __init__(self, rendered):
+        rendered = tuple(rendered)
+        if rendered:
+            self.text = '#allalerts\n' + "".join( text for (routes, key, text) in rendered ) + '__\n'
+        else:
+            self.text = ""
+        ids = ",".join( key for (routes, key, text) in rendered )
+        self.digest = hashlib.sha1(ids).hexdigest()[:12]
+
+_snapshot = None
+
+def currentSnapshot():
+    """Return the alert snapshot, rebuilding it if the alerts have changed"""
+    global _snapshot
+    version = memcache.get(VersionKey)
+    if version is None:
+        # memcache has lost the counter; start a new one so all instances rebuild.
+        memcache.add(VersionKey, freshVersion())
+        version = memcache.get(VersionKey)
+
+    s = _snapshot
+    if s is None or version is None or s.version != version or time.time() - s.built > MaxAge:
+        s = snapshot(version, list(allAlerts()))
+    else:
+        s = s.current()
+    _snapshot = s
+    return s
+
+def alertsChanged():
+    """Tell every instance to rebuild its alert snapshot"""
+    global _snapshot
+    memcache.incr(VersionKey, initial_value=freshVersion())
+    _snapshot = None
+
+def freshVersion():
+    # a starting point that won't repeat one an instance may still be holding
+    return int(time.time())
 
 
 # Temporarily, at least, keep mail we error out on, so we can figure out what happened.
@@ -64,6 +170,7 @@ class NewAlertHandler(InboundMailHandler):
         alert = self.parseMessage(message)
         if alert != None:
             alert.put();
+            alertsChanged()
 
 
     def parseMessage(self, message):
@@ -89,10 +196,7 @@ class NewAlertHandler(InboundMailHandler):
 
             # now extract out the route name from the boilerplate
             boilerplate = parts[-1]
-            routes = 0
-            for routestring in WSF.AlertStringCode.keys():
-                if routestring in boilerplate:
-                    routes |= WSF.AlertStringCode[routestring]
+            routes = WSF.alertRoutes(boilerplate)
             if routes == 0:
                 logging.error("Received message that did not match any routes")
                 postBadMail(message)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+import time
+import threading
+
+"""
+Protection for calls to an outside service (MapQuest): a budget on how fast we call it,
+and a circuit breaker that stops calling it for a while when it keeps failing.
+"""
+# The budget is a token bucket: calls spend a token, tokens come back at rate per second,
+# and up to burst of them can be saved up.  A call when there are no tokens is shed.
+# The breaker is closed (calls go through) until failures consecutive calls have failed.
+# Then it is open (calls are short-circuited) for cooldown seconds, then half-open: up to
+# probes calls at a time are let through to test the service.  A successful probe closes
+# the breaker, a failed one opens it again.
+# Callers are expected to have something else to fall back on when a call is refused.
+
+# The budget comes from our MapQuest key's quota: the free plan allows 15,000 transactions a
+# month, and each travel time lookup is one route matrix call, one transaction.  Spread evenly
+# that is about 500 calls a day, one every 3 minutes.  The burst lets a few clients in a row
+# get live answers; it is a small fraction of a day's calls, so the quota still holds.
+Quota = 15000                           # calls per month
+Rate = Quota / (30 * 24 * 3600.0)       # calls per second, sustained (about 0.0058)
+Burst = 30                              # calls
+Failures = 5                            # consecutive failures
+Cooldown = 30                           # seconds
+Probes = 1                              # calls at a time
+
+Closed = "closed"
+Open = "open"
+HalfOpen = "half-open"
+
+class Refused(Exception):
+    """The call was not made, because it was over budget or the breaker is open"""
+    pass
+
+class breaker(object):
+    def __init__(self, rate=Rate, burst=Burst, failures=Failures, cooldown=Cooldown, probes=Probes):
+        self.rate = rate
+        self.burst = burst
+        self.maxfailures = failures
+        self.cooldown = cooldown
+        self.maxprobes = probes
+        self.lock = threading.Lock()
+        self.tokens = float(burst)
+        self.refilled = time.time()
+        self.state = Closed
+        self.failures = 0       # consecutive failures
+        self.reopen = 0         # when an open breaker goes half-open
+        self.probes = 0         # probes in progress
+        self.accepted = 0
+        self.shed = 0
+        self.shortcircuited = 0
+        self.trips = 0
+
+    def call(self, fn, *args):
+        """Return fn(*args), or raise Refused without calling fn.
+        Any exception from fn counts as a failure."""
+        probe = self.admit()
+        try:
+            result = fn(*args)
+        except Exception:
+            self.finished(probe, False)
+            raise
+        self.finished(probe, True)
+        return result
+
+    def admit(self):
+        """Decide whether a call may go ahead; return true if it is a probe"""
+        now = time.time()
+        with self.lock:
+            if self.state == Open and now >= self.reopen:
+                self.state = HalfOpen
+            if self.state == Open or (self.state == HalfOpen and self.probes >= self.maxprobes):
+                self.shortcircuited += 1
+                raise Refused("circuit open")
+            self.tokens = min(self.burst, self.tokens + (now - self.refilled) * self.rate)
+            self.refilled = now
+            if self.tokens < 1:
+                self.shed += 1
+                raise Refused("over budget")
+            self.tokens -= 1
+            self.accepted += 1
+            if self.state == HalfOpen:
+                self.probes += 1
+                return True
+            return False
+
+    def finished(self, probe, ok):
+        with self.lock:
+            if probe:
+                self.probes -= 1
+            if ok:
+                self.failures = 0
+                if probe:
+                    self.state = Closed
+            else:
+                self.failures += 1
+                if probe or (self.state == Closed and self.failures >= self.maxfailures):
+                    if self.state != Open:
+                        self.trips += 1
+                    self.state = Open
+                    self.reopen = time.time() + self.cooldown
+
+    def stats(self):
+        """Return a printable summary of the state and counters"""
+        return "breaker: {}\naccepted: {}\nshed: {}\nshort-circuited: {}\ntimes opened: {}\n".format(
+            self.state, self.accepted, self.shed, self.shortcircuited, self.trips)
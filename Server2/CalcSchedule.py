@@ -1,60 +1,162 @@
 #!/usr/bin/env python
-from datetime import date
+import re
+from datetime import timedelta
+from array import array
 import CurrentSchedule
+import ScheduleStore
+import WSF
+import pst
 
 def getSchedule(version):
 	"""Return our 'canonical' schedule which shows weekday/weekend times"""
 	# pull out the Sunday and Monday schedules as our canonical examples
-	slist = [ x for x in CurrentSchedule.CurrentSchedule if x.dow == 0 or x.dow == 6 ]
-	return textify(versionify(slist, version), True)
+	return textify(view(version).canonical, True)
 
 
-def getSpecial(version):
-	"""Return a schedule just for today.  Originally this feature only returned special schedules
+def getSpecial(version, today=None):
+	"""Return a schedule just for today (in Pacific time), or for the given date.  Originally this feature only returned special schedules
 	on holidays, but now we return today's schedule every day, which allows us to correctly show times
 	for non-canonical days."""
 	# Further note: we could check whether today's schedule really is special (is different from the canonical)
 	# but why bother?  We just return it.
 
-	dow = date.today().weekday()
-	holidayRoutes = CurrentSchedule.holidayRoutes()
+	if today is None:
+		today = pst.today()
+	dow = today.weekday()
+	holidays = CurrentSchedule.holidayMask(today)
 	specialList = []
-	for x in CurrentSchedule.CurrentSchedule:
-		if x.name in holidayRoutes:  # for holiday routes, use the Sunday schedule
+	for x in view(version).entries:
+		if x.code & holidays:  # for holiday routes, use the Sunday schedule
 			if x.dow == 6:
 				specialList.append(x)
 		elif x.dow == dow:
 			specialList.append(x)
 
-	return textify(versionify(specialList, version), False)
+	return textify(specialList, False)
 
 
-def versionify(list,version):
-    """Correct schedule details for different client versions"""
-    if version == "1.0":
-        return list
-    elif version == "2.0":
-        return v2interpolate(list)
-    elif version == "3.0":
-        return list
-    else: # V4 and higher
-        return v4plus(list)
+def getNext(version, name, direction, now, count):
+	"""Return the next count departures on this route at or after now (a Pacific datetime),
+	as minutes past today's midnight."""
+	route = WSF.RouteIndex.get(name)
+	if route is None or count < 1:
+		return []
+	store = nextView(version)   # names and directions as this client knows them
+	minute = now.hour * 60 + now.minute
+	today = now.date()
+	yesterday = today - timedelta(days=1)
+
+	# sailings just after midnight belong to yesterday's schedule, with times past 24*60
+	times = [ t - 24*60 for t in store.after(name, direction, serviceDow(route.code, yesterday), minute + 24*60, count) ]
+	times += store.after(name, direction, serviceDow(route.code, today), minute, count)
+	return sorted(times)[:count]
+
+
+def serviceDow(code, day):
+	"""Return the day of week whose schedule the route with this code runs on the given date"""
+	if code & CurrentSchedule.holidayMask(day):  # for holiday routes, use the Sunday schedule
+		return 6
+	return day.weekday()
+
+
+V2Dummies = array('H', (200,201))
 
 def v2interpolate(list):
     """V2 clients leave off the first two times, so put dummy ones in"""
-    return [ CurrentSchedule.schedule(x.name,x.direction,x.dow, "200,201," + x.text) for x in list ]
+    return [ CurrentSchedule.schedule(x.name,x.direction,x.dow, V2Dummies + x.times) for x in list ]
+
+PtDefianceRoutes = WSF.routeNames(WSF.routeMask(["vashon-pt defiance"]))
 
 def v4plus(list):
     """At V4 we turned the direction of pt defiance around"""
     newlist = []
     for x in list:
-    	if x.name in ("pt defiance-vashon", "vashon-pt defiance"):
-    		newlist.append( CurrentSchedule.schedule(x.name, "w" if x.direction == "e" else "e", x.dow, x.text) )
+    	if x.name in PtDefianceRoutes:
+    		newlist.append( CurrentSchedule.schedule(x.name, "w" if x.direction == "e" else "e", x.dow, x.times) )
     	else:
     		newlist.append( x )
     return newlist
 
 
+# Older clients need the schedule adjusted to what they understand.  Each entry below covers
+# a range of client versions, lowest included and highest not (None for no limit), and names
+# the view of the schedule those clients get and the transforms that make it from the
+# schedule as we store it: one for the schedule we send, one for the departures /next
+# reports (which must not include anything, like the v2 dummy times, that isn't a sailing).
+# Versions we can't parse, or that aren't covered, get LatestView.
+# The views are made once per schedule (see view), so a request just picks one.
+Transforms = (
+	# from,  to,     view,  schedule,      /next
+	((1,0), (2,0), "1.0", None,          None),
+	((2,0), (3,0), "2.0", v2interpolate, None),
+	((3,0), (4,0), "1.0", None,          None),      # v3 sees what v1 does
+	((4,0), None,  "4.0", v4plus,        v4plus),
+)
+LatestView = "4.0"
+
+# the transforms for each view, and one version from each
+ViewTransforms = dict( (name, (transform, nexttransform)) for (low, high, name, transform, nexttransform) in Transforms )
+VersionBuckets = tuple(sorted(ViewTransforms))
+
+def parseVersion(version):
+	"""Return a version string as a tuple of at least two ints ("4.2" -> (4,2), "v3" -> (3,0)),
+	or None if it isn't one"""
+	m = re.match(r"v?(\d{1,6}(?:\.\d{1,6})*)$", version)
+	if m is None:
+		return None
+	parts = tuple( int(p) for p in m.group(1).split(".") )
+	return parts + (0,) * (2 - len(parts))
+
+_buckets = {}    # version string -> view name; there are only a handful in use
+
+def versionBucket(version):
+	"""Return the name of the view of the schedule this client version gets"""
+	name = _buckets.get(version)
+	if name is None:
+		name = LatestView
+		parsed = parseVersion(version)
+		if parsed is not None:
+			for (low, high, view, transform, nexttransform) in Transforms:
+				if low <= parsed and (high is None or parsed < high):
+					name = view
+					break
+		if len(_buckets) >= 100:
+			_buckets.clear()
+		_buckets[version] = name
+	return name
+
+def versionify(list,version):
+	"""Correct schedule details for different client versions"""
+	(transform, nexttransform) = ViewTransforms[versionBucket(version)]
+	return transform(list) if transform else list
+
+_views = (None, {})    # (store the views were made from, view name -> (schedule store, /next store))
+
+def views(version):
+	"""Return the (schedule, /next) views of the current schedule for this client version"""
+	global _views
+	base = ScheduleStore.current()
+	(source, found) = _views
+	if source is not base:
+		found = {}
+		for (name, (transform, nexttransform)) in ViewTransforms.items():
+			schedule = ScheduleStore.store(tuple(transform(base.entries))) if transform else base
+			if nexttransform is transform:
+				found[name] = (schedule, schedule)
+			else:
+				found[name] = (schedule, ScheduleStore.store(tuple(nexttransform(base.entries))) if nexttransform else base)
+		_views = (base, found)
+	return found[versionBucket(version)]
+
+def view(version):
+	"""Return the current schedule (a ScheduleStore.store) as this client version sees it"""
+	return views(version)[0]
+
+def nextView(version):
+	"""Return the current schedule as this client version sees it, with only real sailings (for getNext)"""
+	return views(version)[1]
+
+
 def textify(list,asCanonical):
 	"""Convert list of routes to string expected by client"""
 	result = ""
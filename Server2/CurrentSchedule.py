@@ -1,197 +1,109 @@
 #!/usr/bin/env python
-from datetime import date
+import time
+import calendar
+import threading
+from datetime import date, datetime, timedelta
+from array import array
+from bisect import bisect_right
+import ScheduleFile
+import WSF
+import pst
 
 #This file is changed every quarter, and sections marked with UPDATE need to be hand edited
-
-# UPDATE
-mindate = date(2017,6,30)
-
-# UPDATE
-schedulename = "Summer 2017 (Jun 25, 2017 - Sep 30, 2017)"
+#The schedules, their names and mindates come from the compiled schedule files (see the end of this file)
 
 class schedule(object):
-    def __init__(self,name,direction,dow,text):
+    __slots__ = ('name', 'direction', 'dow', 'code', 'times', '_text')
+
+    def __init__(self,name,direction,dow,times):
         self.name = name  # canonical name
         self.direction = direction # "w" or "e"
         self.dow = dow    # 0=Monday ... 6=Sunday
-        self.text = text  # comma separated list of times in format used by client
-
-allroutes = ("bainbridge","edmonds","mukilteo","pt townsend",
-            "fauntleroy-southworth","southworth-fauntleroy",
-            "fauntleroy-vashon","vashon-fauntleroy",
-            "vashon-southworth","southworth-vashon",
-            "vashon-pt defiance","pt defiance-vashon",
-            "bremerton","friday harbor","orcas");
+        route = WSF.RouteIndex.get(name)
+        self.code = route.code if route else 0   # WSF route code
+        # departure times in minutes past midnight, in increasing order (so may be > 24*60)
+        # times may be given as a comma separated string, or as any sequence of ints
+        if isinstance(times, basestring):
+            times = [ int(t) for t in times.split(',') ] if times else []
+        self.times = array('H', times)
+        self._text = None
+
+    @property
+    def text(self):
+        """comma separated list of times in format used by client"""
+        if self._text is None:
+            self._text = ",".join(map(str, self.times))
+        return self._text
+
 #UPDATE
-def holidayRoutes():
-    today = date.today()
-    ret = []
-    if (today == date(2017,7,4)):
-        ret = list(set(allroutes) - set(["bremerton","friday harbor","orcas"]))
-    if (today == date(2017,8,4)):
-        ret = list(set(allroutes) - set(["bremerton","mukilteo"]))
-
-    # if (today == date(2016,11,24)) or (today == date(2016,12,25)) or (today == date(2017,1,2)):
-    #     ret = ("bainbridge","edmonds","mukilteo","pt defiance-vashon","vashon-pt defiance")
-    # if (today == date(2016,10,10)):
-    #     ret = ("pt townsend")
-    return ret
-
-
-# UPDATE with content generated by gatherer.  Remove trailing comma
-CurrentSchedule = (
-schedule('bainbridge','w',0,'330,370,425,475,525,575,640,685,740,790,845,900,945,1000,1050,1100,1160,1210,1260,1325,1375,1455,1535'),
-schedule('bainbridge','w',1,'370,475,535,575,635,685,740,790,845,900,945,1000,1050,1100,1160,1210,1260,1305,1360,1395,1485,1570'),
-schedule('bainbridge','w',2,'330,370,425,475,525,575,640,685,740,790,845,900,945,1000,1050,1100,1160,1210,1260,1325,1375,1455,1535'),
-schedule('bainbridge','w',3,'330,370,425,475,525,575,640,685,740,790,845,900,945,1000,1050,1100,1160,1210,1260,1325,1375,1455,1535'),
-schedule('bainbridge','w',4,'330,370,425,475,525,575,640,685,740,790,845,900,945,1000,1050,1100,1160,1210,1260,1325,1375,1455,1535'),
-schedule('bainbridge','w',5,'370,475,535,575,635,685,740,790,845,900,945,1000,1050,1100,1160,1210,1260,1305,1360,1395,1485,1570'),
-schedule('bainbridge','w',6,'370,475,535,575,635,685,740,790,845,900,945,1000,1050,1100,1160,1210,1260,1305,1360,1395,1485,1570'),
-schedule('bainbridge','e',0,'285,320,380,425,475,525,580,625,690,740,790,845,895,950,995,1050,1110,1150,1210,1255,1305,1415,1495'),
-schedule('bainbridge','e',1,'320,425,475,525,585,625,690,740,790,845,895,950,995,1050,1110,1150,1210,1255,1305,1350,1440,1525'),
-schedule('bainbridge','e',2,'285,320,380,425,475,525,580,625,690,740,790,845,895,950,995,1050,1110,1150,1210,1255,1305,1415,1495'),
-schedule('bainbridge','e',3,'285,320,380,425,475,525,580,625,690,740,790,845,895,950,995,1050,1110,1150,1210,1255,1305,1415,1495'),
-schedule('bainbridge','e',4,'285,320,380,425,475,525,580,625,690,740,790,845,895,950,995,1050,1110,1150,1210,1255,1305,1415,1495'),
-schedule('bainbridge','e',5,'320,425,475,525,585,625,690,740,790,845,895,950,995,1050,1110,1150,1210,1255,1305,1350,1440,1525'),
-schedule('bainbridge','e',6,'320,425,525,585,625,690,740,790,845,895,950,995,1050,1110,1150,1210,1255,1305,1350,1440,1525'),
-schedule('edmonds','w',0,'335,380,430,475,530,580,630,670,725,760,820,865,915,955,1005,1045,1095,1140,1180,1230,1260,1345,1425'),
-schedule('edmonds','w',1,'335,430,475,530,580,630,670,725,760,820,865,915,955,1005,1045,1095,1140,1180,1230,1260,1310,1345,1425'),
-schedule('edmonds','w',2,'335,380,430,475,530,580,630,670,725,760,820,865,915,955,1005,1045,1095,1140,1180,1230,1260,1345,1425'),
-schedule('edmonds','w',3,'335,380,430,475,530,580,630,670,725,760,820,865,915,955,1005,1045,1095,1140,1180,1230,1260,1345,1425'),
-schedule('edmonds','w',4,'335,380,430,475,530,580,630,670,725,760,820,865,915,955,1005,1045,1095,1140,1180,1230,1260,1310,1345,1390,1425,1495'),
-schedule('edmonds','w',5,'335,380,430,475,530,580,630,670,725,760,820,865,915,955,1005,1045,1095,1140,1180,1230,1260,1310,1345,1425'),
-schedule('edmonds','w',6,'430,475,530,580,630,670,725,760,820,865,915,955,1005,1045,1095,1140,1180,1230,1260,1310,1345,1390,1425'),
-schedule('edmonds','e',0,'295,335,385,425,475,520,580,625,675,715,770,810,870,910,960,1000,1050,1090,1140,1185,1220,1300,1385'),
-schedule('edmonds','e',1,'295,385,425,475,520,580,625,675,715,770,810,870,910,960,1000,1050,1090,1140,1185,1220,1270,1300,1385'),
-schedule('edmonds','e',2,'295,335,385,425,475,520,580,625,675,715,770,810,870,910,960,1000,1050,1090,1140,1185,1220,1300,1385'),
-schedule('edmonds','e',3,'295,335,385,425,475,520,580,625,675,715,770,810,870,910,960,1000,1050,1090,1140,1185,1220,1300,1385'),
-schedule('edmonds','e',4,'295,335,385,425,475,520,580,625,675,715,770,810,870,910,960,1000,1050,1090,1140,1185,1220,1270,1300,1350,1385,1445'),
-schedule('edmonds','e',5,'295,335,385,425,475,520,580,625,675,715,770,810,870,910,960,1000,1050,1090,1140,1185,1220,1270,1300,1385'),
-schedule('edmonds','e',6,'385,425,475,520,580,625,675,715,770,810,870,910,960,1000,1050,1090,1140,1185,1220,1270,1300,1350,1385'),
-schedule('mukilteo','w',0,'305,335,360,390,420,450,480,510,540,570,600,630,660,690,720,750,780,815,845,875,905,935,965,1000,1030,1060,1090,1120,1145,1175,1205,1235,1260,1290,1320,1350,1380,1440,1505,1560'),
-schedule('mukilteo','w',1,'360,420,480,510,540,570,600,630,660,690,720,750,780,815,845,875,905,935,965,1000,1030,1060,1090,1120,1145,1175,1205,1235,1260,1290,1320,1350,1380,1410,1440,1505,1560'),
-schedule('mukilteo','w',2,'305,335,360,390,420,450,480,510,540,570,600,630,660,690,720,750,780,815,845,875,905,935,965,1000,1030,1060,1090,1120,1145,1175,1205,1235,1260,1320,1380,1440,1505'),
-schedule('mukilteo','w',3,'305,335,360,390,420,450,480,510,540,570,600,630,660,690,720,750,780,815,845,875,905,935,965,1000,1030,1060,1090,1120,1145,1175,1205,1235,1260,1290,1320,1380,1440,1505'),
-schedule('mukilteo','w',4,'305,335,360,390,420,450,480,510,540,570,600,630,660,690,720,750,780,815,845,875,905,935,965,1000,1030,1060,1090,1120,1145,1175,1205,1235,1260,1290,1320,1350,1380,1410,1440,1505,1560'),
-schedule('mukilteo','w',5,'360,390,420,450,480,510,540,570,600,630,660,690,720,750,780,815,845,875,905,935,965,1000,1030,1060,1090,1120,1145,1175,1205,1235,1260,1290,1320,1350,1380,1410,1440,1505,1560'),
-schedule('mukilteo','w',6,'360,420,480,510,540,570,600,630,660,690,720,750,780,815,845,875,905,935,965,1000,1030,1060,1090,1120,1145,1175,1205,1235,1260,1290,1320,1350,1380,1410,1440,1505'),
-schedule('mukilteo','e',0,'280,305,330,360,390,420,450,480,510,540,570,600,630,660,690,720,750,780,810,840,875,905,935,965,995,1025,1055,1085,1115,1145,1175,1200,1230,1260,1290,1320,1350,1410,1470,1530'),
-schedule('mukilteo','e',1,'330,390,450,480,510,540,570,600,630,660,690,720,750,780,810,840,875,905,935,965,995,1025,1055,1085,1115,1145,1175,1200,1230,1260,1290,1320,1350,1380,1410,1470,1530'),
-schedule('mukilteo','e',2,'280,305,330,360,390,420,450,480,510,540,570,600,630,660,690,720,750,780,810,840,875,905,935,965,995,1025,1055,1085,1115,1145,1175,1200,1230,1290,1350,1410,1470'),
-schedule('mukilteo','e',3,'280,305,330,360,390,420,450,480,510,540,570,600,630,660,690,720,750,780,810,840,875,905,935,965,995,1025,1055,1085,1115,1145,1175,1200,1230,1260,1290,1350,1410,1470'),
-schedule('mukilteo','e',4,'280,305,330,360,390,420,450,480,510,540,570,600,630,660,690,720,750,780,810,840,875,905,935,965,995,1025,1055,1085,1115,1145,1175,1200,1230,1260,1290,1320,1350,1380,1410,1470,1530'),
-schedule('mukilteo','e',5,'330,360,390,420,450,480,510,540,570,600,630,660,690,720,750,780,810,840,875,905,935,965,995,1025,1055,1085,1115,1145,1175,1200,1230,1260,1290,1320,1350,1380,1410,1470,1530'),
-schedule('mukilteo','e',6,'330,390,450,480,510,540,570,600,630,660,690,720,750,780,810,840,875,905,935,965,995,1025,1055,1085,1115,1145,1175,1200,1230,1260,1290,1320,1350,1380,1410,1470'),
-schedule('pt townsend','w',0,'435,525,570,615,660,705,750,795,840,885,930,975,1080,1170,1270'),
-schedule('pt townsend','w',1,'435,525,615,660,705,750,795,840,885,930,975,1020,1080,1170,1270'),
-schedule('pt townsend','w',2,'435,525,570,615,660,705,750,795,840,885,930,975,1080,1170,1270'),
-schedule('pt townsend','w',3,'435,525,570,615,660,705,750,795,840,885,930,975,1080,1170,1270'),
-schedule('pt townsend','w',4,'435,525,615,660,705,750,795,840,885,930,975,1020,1080,1125,1170,1270,1360'),
-schedule('pt townsend','w',5,'435,525,615,660,705,750,795,840,885,930,975,1020,1080,1170,1270,1360'),
-schedule('pt townsend','w',6,'435,525,615,660,705,750,795,840,885,930,975,1020,1080,1170,1270'),
-schedule('pt townsend','e',0,'390,480,525,570,615,660,705,750,795,840,885,930,1035,1125,1230'),
-schedule('pt townsend','e',1,'390,480,570,615,660,705,750,795,840,885,930,975,1035,1125,1230'),
-schedule('pt townsend','e',2,'390,480,525,570,615,660,705,750,795,840,885,930,1035,1125,1230'),
-schedule('pt townsend','e',3,'390,480,525,570,615,660,705,750,795,840,885,930,1035,1125,1230'),
-schedule('pt townsend','e',4,'390,480,570,615,660,705,750,795,840,885,930,975,1035,1080,1125,1230,1320'),
-schedule('pt townsend','e',5,'390,480,570,615,660,705,750,795,840,885,930,975,1035,1125,1230,1320'),
-schedule('pt townsend','e',6,'390,480,570,615,660,705,750,795,840,885,930,975,1035,1125,1230'),
-schedule('fauntleroy-southworth','w',0,'265,310,350,425,470,525,545,570,620,695,740,820,855,900,935,980,1030,1065,1115,1170,1255,1340,1420,1495,1570'),
-schedule('fauntleroy-southworth','w',1,'310,365,405,460,500,565,615,655,715,740,820,870,905,965,1065,1085,1175,1255,1340,1420,1495,1570'),
-schedule('fauntleroy-southworth','w',2,'265,310,350,425,470,525,545,570,620,695,740,820,855,900,935,980,1030,1065,1115,1170,1255,1340,1420,1495,1570'),
-schedule('fauntleroy-southworth','w',3,'265,310,350,425,470,525,545,570,620,695,740,820,855,900,935,980,1030,1065,1115,1170,1255,1340,1420,1495,1570'),
-schedule('fauntleroy-southworth','w',4,'265,310,350,425,470,525,545,570,620,695,740,820,855,900,935,980,1030,1065,1115,1170,1255,1340,1420,1495,1570'),
-schedule('fauntleroy-southworth','w',5,'310,365,405,460,500,565,615,655,715,740,820,870,905,965,1065,1085,1175,1255,1340,1420,1495,1570'),
-schedule('fauntleroy-southworth','w',6,'310,365,405,460,500,565,615,655,715,740,820,870,905,965,1065,1085,1175,1255,1340,1420,1495,1570'),
-schedule('southworth-fauntleroy','e',0,'260,300,360,400,475,500,560,595,615,670,745,790,865,890,945,965,1030,1075,1110,1160,1225,1385,1465,1540'),
-schedule('southworth-fauntleroy','e',1,'260,355,410,450,505,555,620,660,705,745,790,875,915,960,1025,1095,1140,1220,1310,1385,1465,1540'),
-schedule('southworth-fauntleroy','e',2,'260,300,360,400,475,500,560,595,615,670,745,790,865,890,945,965,1030,1075,1110,1160,1225,1385,1465,1540'),
-schedule('southworth-fauntleroy','e',3,'260,300,360,400,475,500,560,595,615,670,745,790,865,890,945,965,1030,1075,1110,1160,1225,1385,1465,1540'),
-schedule('southworth-fauntleroy','e',4,'260,300,360,400,475,500,560,595,615,670,745,790,865,890,945,965,1030,1075,1110,1160,1225,1295,1385,1465,1540'),
-schedule('southworth-fauntleroy','e',5,'260,355,410,450,505,555,620,660,705,745,790,875,915,960,1025,1095,1140,1220,1310,1385,1465,1540'),
-schedule('southworth-fauntleroy','e',6,'260,355,410,450,505,555,620,660,705,745,790,875,915,960,1025,1095,1140,1220,1310,1385,1465,1540'),
-schedule('fauntleroy-vashon','w',0,'310,350,370,410,425,505,545,570,620,640,675,695,715,740,775,805,820,885,900,960,1005,1030,1065,1085,1115,1145,1170,1205,1255,1280,1340,1420,1495,1570'),
-schedule('fauntleroy-vashon','w',1,'310,365,405,460,500,530,565,590,615,655,680,715,740,765,795,820,845,870,905,930,965,990,1015,1045,1085,1110,1150,1175,1195,1215,1255,1280,1340,1375,1420,1495,1570'),
-schedule('fauntleroy-vashon','w',2,'310,350,370,410,425,505,545,570,620,640,675,695,715,740,775,805,820,885,900,960,1005,1030,1065,1085,1115,1145,1170,1205,1255,1280,1340,1420,1495,1570'),
-schedule('fauntleroy-vashon','w',3,'310,350,370,410,425,505,545,570,620,640,675,695,715,740,775,805,820,885,900,960,1005,1030,1065,1085,1115,1145,1170,1205,1255,1280,1340,1420,1495,1570'),
-schedule('fauntleroy-vashon','w',4,'310,350,370,410,425,505,545,570,620,640,675,695,715,740,775,805,820,885,900,960,1005,1030,1065,1085,1115,1145,1170,1205,1255,1280,1340,1420,1495,1570'),
-schedule('fauntleroy-vashon','w',5,'310,365,405,460,500,530,565,590,615,655,680,715,740,765,795,820,845,870,905,930,965,990,1015,1045,1085,1110,1150,1175,1195,1215,1255,1280,1340,1375,1420,1495,1570'),
-schedule('fauntleroy-vashon','w',6,'310,365,405,460,500,530,565,590,615,655,680,715,740,765,795,820,845,870,905,930,965,990,1015,1045,1085,1110,1150,1175,1195,1215,1255,1280,1340,1375,1420,1495,1570'),
-schedule('vashon-fauntleroy','e',0,'245,280,320,345,380,400,420,440,475,495,520,540,580,615,635,690,710,745,765,830,860,925,995,1030,1055,1115,1140,1180,1230,1245,1315,1365,1445,1520'),
-schedule('vashon-fauntleroy','e',1,'280,335,375,430,470,495,530,560,580,620,645,685,710,730,765,790,815,835,870,900,935,960,985,1015,1055,1075,1115,1145,1165,1185,1245,1310,1335,1365,1445,1520'),
-schedule('vashon-fauntleroy','e',2,'245,280,320,345,380,400,420,440,475,495,520,540,580,615,635,690,710,745,765,830,860,925,995,1030,1055,1115,1140,1180,1230,1245,1315,1365,1445,1520'),
-schedule('vashon-fauntleroy','e',3,'245,280,320,345,380,400,420,440,475,495,520,540,580,615,635,690,710,745,765,830,860,925,995,1030,1055,1115,1140,1180,1230,1245,1315,1365,1445,1520'),
-schedule('vashon-fauntleroy','e',4,'245,280,320,345,380,400,420,440,475,495,520,540,580,615,635,690,710,745,765,830,860,925,995,1030,1055,1115,1140,1180,1230,1245,1315,1365,1445,1520'),
-schedule('vashon-fauntleroy','e',5,'280,335,375,430,470,495,530,560,580,620,645,685,710,730,765,790,815,835,870,900,935,960,985,1015,1055,1075,1115,1145,1165,1185,1245,1310,1335,1365,1445,1520'),
-schedule('vashon-fauntleroy','e',6,'280,335,375,430,470,495,530,560,580,620,645,685,710,730,765,790,815,835,870,900,935,960,985,1015,1055,1075,1115,1145,1165,1185,1245,1310,1335,1365,1445,1520'),
-schedule('vashon-southworth','w',0,'245,335,375,450,570,595,645,720,765,845,925,1055,1090,1140,1195,1280,1365,1445,1520,1600'),
-schedule('vashon-southworth','w',1,'335,390,430,485,530,595,640,685,770,850,895,935,995,1115,1200,1285,1365,1445,1520,1600'),
-schedule('vashon-southworth','w',2,'245,335,375,450,570,595,645,720,765,845,925,1055,1090,1140,1195,1280,1365,1445,1520,1600'),
-schedule('vashon-southworth','w',3,'245,335,375,450,570,595,645,720,765,845,925,1055,1090,1140,1195,1280,1365,1445,1520,1600'),
-schedule('vashon-southworth','w',4,'245,335,375,450,570,595,645,720,765,845,925,1055,1090,1140,1195,1280,1365,1445,1520,1600'),
-schedule('vashon-southworth','w',5,'335,390,430,485,530,595,640,685,770,850,895,935,995,1115,1200,1285,1365,1445,1520,1600'),
-schedule('vashon-southworth','w',6,'335,390,430,485,530,595,640,685,770,850,895,935,995,1115,1200,1285,1365,1445,1520,1600'),
-schedule('southworth-vashon','e',0,'260,300,360,400,475,500,560,595,615,670,745,790,865,965,1030,1110,1160,1225,1385,1465,1540'),
-schedule('southworth-vashon','e',1,'260,355,410,450,505,555,620,660,705,745,790,875,915,960,1095,1140,1220,1310,1385,1465,1540'),
-schedule('southworth-vashon','e',2,'260,300,360,400,475,500,560,595,615,670,745,790,865,965,1030,1110,1160,1225,1385,1465,1540'),
-schedule('southworth-vashon','e',3,'260,300,360,400,475,500,560,595,615,670,745,790,865,965,1030,1110,1160,1225,1385,1465,1540'),
-schedule('southworth-vashon','e',4,'260,300,360,400,475,500,560,595,615,670,745,790,865,965,1030,1110,1160,1225,1295,1385,1465,1540'),
-schedule('southworth-vashon','e',5,'260,355,410,450,505,555,620,660,705,745,790,875,915,960,1095,1140,1220,1310,1385,1465,1540'),
-schedule('southworth-vashon','e',6,'260,355,410,450,505,555,620,660,705,745,790,875,915,960,1095,1140,1220,1310,1385,1465,1540'),
-schedule('bremerton','w',0,'360,455,510,600,670,755,810,900,980,1055,1125,1195,1265,1350,1490'),
-schedule('bremerton','w',1,'360,455,510,600,670,755,810,900,980,1055,1125,1195,1265,1350,1490'),
-schedule('bremerton','w',2,'360,455,510,600,670,755,810,900,980,1055,1125,1195,1265,1350,1490'),
-schedule('bremerton','w',3,'360,455,510,600,670,755,810,900,980,1055,1125,1195,1265,1350,1490'),
-schedule('bremerton','w',4,'360,455,510,600,670,755,810,900,980,1055,1125,1195,1265,1350,1490'),
-schedule('bremerton','w',5,'360,455,510,600,670,755,810,900,980,1055,1125,1195,1265,1350,1490'),
-schedule('bremerton','w',6,'360,455,510,600,670,755,810,900,980,1055,1125,1195,1265,1350,1490'),
-schedule('bremerton','e',0,'290,380,440,525,585,670,740,825,900,980,1050,1125,1195,1265,1420'),
-schedule('bremerton','e',1,'290,380,440,525,585,670,740,825,900,980,1050,1125,1195,1265,1420'),
-schedule('bremerton','e',2,'290,380,440,525,585,670,740,825,900,980,1050,1125,1195,1265,1420'),
-schedule('bremerton','e',3,'290,380,440,525,585,670,740,825,900,980,1050,1125,1195,1265,1420'),
-schedule('bremerton','e',4,'290,380,440,525,585,670,740,825,900,980,1050,1125,1195,1265,1420'),
-schedule('bremerton','e',5,'290,380,440,525,585,670,740,825,900,980,1050,1125,1195,1265,1420'),
-schedule('bremerton','e',6,'380,440,525,585,670,740,825,900,980,1050,1125,1195,1265,1420'),
-schedule('vashon-pt defiance','w',0,'330,380,430,480,530,580,630,680,730,850,910,965,1020,1080,1140,1200,1260,1320,1375'),
-schedule('vashon-pt defiance','w',1,'380,430,480,530,580,630,680,730,780,850,910,965,1020,1080,1140,1200,1260,1320,1375'),
-schedule('vashon-pt defiance','w',2,'330,380,430,480,530,580,630,680,730,850,910,965,1020,1080,1140,1200,1260,1320,1375'),
-schedule('vashon-pt defiance','w',3,'330,380,430,480,530,580,630,680,730,850,910,965,1020,1080,1140,1200,1260,1320,1375'),
-schedule('vashon-pt defiance','w',4,'330,380,430,480,530,580,630,680,730,780,850,910,965,1020,1080,1140,1200,1260,1320,1375'),
-schedule('vashon-pt defiance','w',5,'380,430,480,530,580,630,680,730,780,850,910,965,1020,1080,1140,1200,1260,1320,1375'),
-schedule('vashon-pt defiance','w',6,'380,430,480,530,580,630,680,730,780,850,910,965,1020,1080,1140,1200,1260,1320,1375'),
-schedule('pt defiance-vashon','e',0,'305,355,405,455,505,555,605,655,705,820,880,940,995,1050,1110,1165,1225,1290,1350'),
-schedule('pt defiance-vashon','e',1,'355,405,455,505,555,605,655,705,755,820,880,940,995,1050,1110,1165,1225,1290,1350'),
-schedule('pt defiance-vashon','e',2,'305,355,405,455,505,555,605,655,705,820,880,940,995,1050,1110,1165,1225,1290,1350'),
-schedule('pt defiance-vashon','e',3,'305,355,405,455,505,555,605,655,705,820,880,940,995,1050,1110,1165,1225,1290,1350'),
-schedule('pt defiance-vashon','e',4,'305,355,405,455,505,555,605,655,705,755,820,880,940,995,1050,1110,1165,1225,1290,1350'),
-schedule('pt defiance-vashon','e',5,'355,405,455,505,555,605,655,705,755,820,880,940,995,1050,1110,1165,1225,1290,1350'),
-schedule('pt defiance-vashon','e',6,'355,405,455,505,555,605,655,705,755,820,880,940,995,1050,1110,1165,1225,1290,1350'),
-schedule('friday harbor','w',0,'255,385,545,715,840,1005,1220'),
-schedule('friday harbor','w',1,'255,385,545,715,840,1005,1220'),
-schedule('friday harbor','w',2,'255,385,545,715,840,1005,1220'),
-schedule('friday harbor','w',3,'255,385,545,715,840,1005,1220'),
-schedule('friday harbor','w',4,'255,385,545,715,840,1005,1220,1250,1380'),
-schedule('friday harbor','w',5,'255,385,545,715,840,1005,1220'),
-schedule('friday harbor','w',6,'255,385,545,715,840,1005,1220'),
-schedule('friday harbor','e',0,'345,485,660,830,945,1110,1320'),
-schedule('friday harbor','e',1,'345,485,660,830,945,1110,1320'),
-schedule('friday harbor','e',2,'345,485,660,830,945,1110,1320,1330'),
-schedule('friday harbor','e',3,'345,485,660,830,945,1110,1320'),
-schedule('friday harbor','e',4,'345,485,660,830,945,1110,1320'),
-schedule('friday harbor','e',5,'345,485,660,830,945,1110,1320'),
-schedule('friday harbor','e',6,'345,485,660,830,855,945,1110,1320'),
-schedule('orcas','w',0,'360,445,620,755,945,1160,1260'),
-schedule('orcas','w',1,'360,445,620,755,945,1160,1260'),
-schedule('orcas','w',2,'360,445,620,755,945,1160,1260'),
-schedule('orcas','w',3,'360,445,620,755,945,1160,1260'),
-schedule('orcas','w',4,'360,445,620,755,945,1160,1250,1260,1380'),
-schedule('orcas','w',5,'360,445,620,755,945,1160,1260'),
-schedule('orcas','w',6,'360,445,620,755,945,1160,1260'),
-schedule('orcas','e',0,'455,530,725,860,1035,1245,1370'),
-schedule('orcas','e',1,'455,530,725,860,1035,1245,1370'),
-schedule('orcas','e',2,'455,530,725,860,1035,1245,1370'),
-schedule('orcas','e',3,'455,530,725,860,1035,1245,1370'),
-schedule('orcas','e',4,'455,530,725,860,1035,1245,1370'),
-schedule('orcas','e',5,'455,530,725,860,1035,1245,1370'),
-schedule('orcas','e',6,'455,530,725,860,1035,1245,1370')
-)
+# Holidays: for each date, the mask of routes that run their Sunday schedule that day.
+Holidays = {
+    date(2017,7,4): WSF.AllRoutes & ~WSF.routeMask(["bremerton","friday harbor","orcas"]),
+    date(2017,8,4): WSF.AllRoutes & ~WSF.routeMask(["bremerton","mukilteo"]),
+    # date(2016,11,24): WSF.routeMask(["bainbridge","edmonds","mukilteo","pt defiance-vashon"]),
+    # date(2016,10,10): WSF.routeMask(["pt townsend"]),
+}
+
+def holidayMask(day):
+    """Return the mask of routes running a holiday (Sunday) schedule on the given date"""
+    return Holidays.get(day, 0)
+
+
+# The schedules themselves are compiled from the content generated by the gatherer
+# (see Gatherer/compileschedule.py).  We load every compiled period we have, so that an
+# upcoming schedule can be installed ahead of time: the switch to it happens here, at
+# Pacific midnight on its mindate, with no deploy.
+# activePeriod() is called on every request, but only does real work once a day.
+
+class period(object):
+    """One schedule period"""
+    def __init__(self, mindate, name, schedules):
+        self.mindate = mindate     # first date this schedule is in effect
+        self.name = name
+        self.schedules = schedules
+
+def load(path):
+    """Return the period from a compiled schedule file"""
+    (mindate, name, entries) = ScheduleFile.read(path)
+    return period(mindate, name, tuple( schedule(*e) for e in entries ))
+
+Periods = tuple( sorted( (load(path) for path in ScheduleFile.allfiles()), key=lambda p: p.mindate ) )
+_starts = [ p.mindate for p in Periods ]
+
+def periodFor(day):
+    """Return the period in effect on the given date, or None if that is before all of them"""
+    i = bisect_right(_starts, day)
+    return Periods[i-1] if i > 0 else None
+
+def activePeriod():
+    """Return the period in effect now"""
+    if time.time() >= _nextswap:
+        activate()
+    return _active
+
+def activate():
+    """Choose the period in effect now, and note when we next need to check"""
+    global _active, _nextswap, mindate, schedulename, CurrentSchedule
+    with _lock:
+        now = datetime.now(pst.pacific)
+        p = periodFor(now.date()) or Periods[0]
+        if p is not _active:
+            # the request path only uses activePeriod(), which swaps in one assignment;
+            # the globals are for compatibility (and tests), and may briefly lag it.
+            _active = p
+            (mindate, schedulename, CurrentSchedule) = (p.mindate, p.name, p.schedules)
+        midnight = pst.toUTC( datetime.combine(now.date() + timedelta(days=1), datetime.min.time()) )
+        _nextswap = calendar.timegm(midnight.utctimetuple())
+
+def replaceForTest(schedules):
+    """Make the active period one with the given schedules (and no swapping at midnight).  For tests only."""
+    global _active, _nextswap, CurrentSchedule
+    activePeriod()
+    _active = period(_active.mindate, _active.name, schedules)
+    CurrentSchedule = schedules
+    _nextswap = float("inf")
+
+_lock = threading.Lock()
+_active = None
+_nextswap = 0
+activate()
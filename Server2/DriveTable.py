@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+import os
+import struct
+import logging
+try:
+    import mmap
+except ImportError:   # not available in the app engine sandbox
+    mmap = None
+
+"""
+Precomputed drive times from a grid of locations to each ferry terminal.
+"""
+# When MapQuest can't answer we estimate travel times from this table instead.  It is built
+# offline (Gatherer/buildtraveltimes.py) by asking MapQuest about every point of a lat/lon
+# grid over Puget Sound, applying the same "which side of the water" filtering we use for
+# live results.
+#
+# File format (all little-endian):
+#   header: magic "NFDT", format version, lat0, lon0, step, nlat, nlon, nterm
+#   nterm terminal codes (uint16)
+#   nlat * nlon cells, each nterm minutes (uint16), Missing where the terminal isn't reachable
+# Cell (i,j) is the point lat0 + i*step, lon0 + j*step.
+#
+# The file is memory-mapped where that is possible, and we only ever read the cells around
+# the point we are asked about.
+
+Magic = "NFDT"
+FormatVersion = 1
+Missing = 0xFFFF
+Header = struct.Struct("<4sHdddHHH")
+DefaultPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), "drivetimes.dat")
+
+class table(object):
+    def __init__(self, data):
+        (magic, version, self.lat0, self.lon0, self.step, self.nlat, self.nlon, self.nterm) = \
+            Header.unpack_from(data, 0)
+        if magic != Magic or version != FormatVersion:
+            raise ValueError("not a drive time table (version %d)" % FormatVersion)
+        self.codes = struct.unpack_from("<%dH" % self.nterm, data, Header.size)
+        self.cell = struct.Struct("<%dH" % self.nterm)
+        self.start = Header.size + 2 * self.nterm
+        self.data = data
+
+    def cellTimes(self, i, j):
+        """Return the minutes to each terminal from grid point (i,j)"""
+        return self.cell.unpack_from(self.data, self.start + (i * self.nlon + j) * self.cell.size)
+
+    def lookup(self, lat, lon):
+        """Return a list of (terminal code, minutes) estimated for this position,
+        or None if the position is outside the table."""
+        y = (lat - self.lat0) / self.step
+        x = (lon - self.lon0) / self.step
+        i = int(y)
+        j = int(x)
+        if y < 0 or x < 0 or i >= self.nlat - 1 or j >= self.nlon - 1:
+            return None
+        fy = y - i
+        fx = x - j
+        corners = (self.cellTimes(i, j), self.cellTimes(i, j+1),
+                   self.cellTimes(i+1, j), self.cellTimes(i+1, j+1))
+        # the corner nearest the position decides whether a terminal is reachable
+        nearest = corners[(2 if fy >= 0.5 else 0) + (1 if fx >= 0.5 else 0)]
+
+        result = []
+        for t in range(self.nterm):
+            if nearest[t] == Missing:
+                continue
+            (a, b, c, d) = [ corner[t] for corner in corners ]
+            if Missing in (a, b, c, d):
+                # interpolating across the water makes no sense; take the nearest value
+                minutes = nearest[t]
+            else:
+                minutes = (a * (1-fx) + b * fx) * (1-fy) + (c * (1-fx) + d * fx) * fy
+            result.append( (self.codes[t], int(round(minutes))) )
+        return result
+
+
+def load(path=DefaultPath):
+    """Return the table stored at path, or None if it isn't there"""
+    if not os.path.exists(path):
+        logging.info("No drive time table at %s", path)
+        return None
+    with open(path, "rb") as f:
+        data = None
+        if mmap is not None:
+            try:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except EnvironmentError:
+                pass
+        if data is None:
+            data = f.read()
+    return table(data)
+
+
+def write(path, lat0, lon0, step, nlat, nlon, codes, cells):
+    """Write a table.  cells is a sequence of nlat*nlon sequences of minutes, one per code"""
+    with open(path, "wb") as f:
+        f.write(Header.pack(Magic, FormatVersion, lat0, lon0, step, nlat, nlon, len(codes)))
+        f.write(struct.pack("<%dH" % len(codes), *codes))
+        cell = struct.Struct("<%dH" % len(codes))
+        for times in cells:
+            f.write(cell.pack(*times))
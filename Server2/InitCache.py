@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+import threading
+import hashlib
+import gzip
+import StringIO
+import pst
+import CurrentSchedule
+import CalcSchedule
+
+"""
+Cache of the /init response.
+"""
+# The schedule and special sections only depend on the client version, the (Pacific) date
+# and the schedule period (holiday routes are fixed per date, in CurrentSchedule.Holidays,
+# and only change when the app is uploaded), so there is no reason to recompute
+# them on every request.  We keep them as ready-to-write strings, one set per version bucket
+# (see CalcSchedule.versionBucket), and throw the whole lot away when the day or the
+# schedule changes.
+# Combined with the alerts, they make a handful of distinct complete responses a day; we keep
+# each of those both plain and gzipped, so compressing costs nothing per request.
+
+MaxBodies = 16  # per sections; there are only ever a few alert versions (and route selections of them) alive at once
+
+class sections(object):
+    """The pre-rendered sections of the /init response for one version bucket on one day"""
+    def __init__(self, schedule, special):
+        self.schedule = schedule  # '#schedule' through '#name' lines
+        self.special = special    # '#special' section, or "" if there is none
+        # digests of what we send without and with the schedule section
+        self.digests = ( hashlib.sha1(special).hexdigest()[:16],
+                         hashlib.sha1(schedule + special).hexdigest()[:16] )
+
+        self.bodies = {}   # (withschedule, alerts digest) -> body
+
+    def etag(self, withschedule, alertsversion, gzipped=False):
+        """Return the (strong) ETag for a response built from these sections.
+        The gzipped response is a different representation, so it gets its own ETag."""
+        return self.digests[1 if withschedule else 0] + "-" + alertsversion + ("-gz" if gzipped else "")
+
+    def body(self, withschedule, alerts):
+        """Return the complete response with (or without) the schedule and with the given alerts (an Alert.selection)"""
+        key = (withschedule, alerts.digest)
+        found = self.bodies.get(key)
+        if found is None:
+            if len(self.bodies) >= MaxBodies:
+                self.bodies = {}
+            text = (self.schedule if withschedule else "") + self.special + alerts.text + '#done\n'
+            found = body(text)
+            self.bodies[key] = found
+        return found
+
+
+class body(object):
+    """One complete /init response"""
+    def __init__(self, plain):
+        self.plain = plain
+        self.gzipped = compress(plain)
+
+
+def compress(text):
+    """Return text gzipped"""
+    out = StringIO.StringIO()
+    f = gzip.GzipFile(fileobj=out, mode='wb', compresslevel=9, mtime=0)
+    f.write(text)
+    f.close()
+    return out.getvalue()
+
+
+class daycache(object):
+    """All the sections built for one (date, schedule period)"""
+    def __init__(self, daykey):
+        self.daykey = daykey
+        self.buckets = {}   # version bucket -> sections
+
+
+_current = None
+_lock = threading.Lock()
+
+
+def getSections(clientversion):
+    """Return the sections object to send to this client today"""
+    today = pst.today()
+    cache = currentDay(today)
+    bucket = CalcSchedule.versionBucket(clientversion)
+    found = cache.buckets.get(bucket)
+    if found is None:
+        found = build(clientversion, today)
+        cache.buckets[bucket] = found
+    return found
+
+
+def prewarm():
+    """Build today's sections for every version bucket, so that no client request has to"""
+    for version in CalcSchedule.VersionBuckets:
+        getSections(version)
+
+
+def currentDay(today):
+    """Return the cache for today, starting a new one if the day or the schedule has changed"""
+    global _current
+    daykey = (today, CurrentSchedule.activePeriod())
+    cache = _current
+    if cache is None or cache.daykey != daykey:
+        with _lock:
+            cache = _current
+            if cache is None or cache.daykey != daykey:
+                cache = daycache(daykey)
+                _current = cache
+    return cache
+
+
+def build(clientversion, today):
+    schedule = '#schedule {:%Y.%m.%d}\n'.format(today) + \
+               CalcSchedule.getSchedule(clientversion) + \
+               '#name ' + CurrentSchedule.activePeriod().name + '\n'
+
+    special = CalcSchedule.getSpecial(clientversion, today)
+    if special:
+        special = '#special\n' + special
+
+    return sections(str(schedule), str(special))
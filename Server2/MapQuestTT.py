@@ -1,9 +1,23 @@
 #!/usr/bin/env python
 import urllib2
+import socket
 import logging
 import json
 import re
+import time
+import threading
 import WSF
+import TTCache
+import Breaker
+import Timing
+import DriveTable
+try:
+    from google.appengine.api import urlfetch
+    from google.appengine.api.background_thread import start_new_background_thread
+except ImportError:
+    # running outside app engine (e.g. Gatherer/buildtraveltimes.py)
+    urlfetch = None
+    start_new_background_thread = None
 
 """
 Determine the travel times to ferry terminals from the client's current location.
@@ -16,11 +30,103 @@ Determine the travel times to ferry terminals from the client's current location
 # is required to get there).   We use a set of heuristics to filter out the unreasonable ones,
 # and generally reduce the result to the minimal information the client needs.
 
+# Nearby clients share results through this cache, and concurrent requests from the
+# same place share a single MapQuest call.
+travelcache = TTCache.cache()
+inflight = TTCache.flights()
+
+# Calls to MapQuest are limited to what our key's quota allows, and stop for a while when
+# MapQuest is failing (see Breaker).  Refused calls fall back like failed ones.
+guard = Breaker.breaker()
+
+# When a cached answer has expired we return it anyway, and refresh it in the background.
+# When there is no cached answer the request waits on MapQuest, but for no more than Deadline
+# seconds; if it doesn't answer by then, or fails, we estimate the times from a precomputed
+# table instead (see DriveTable).
+Deadline = 3
+drivetable = DriveTable.load()
+
+class Unavailable(Exception):
+    """MapQuest could not give us an answer"""
+    pass
+
+class Refused(Unavailable):
+    """We didn't ask MapQuest, because of the budget or the breaker (see Breaker)"""
+    pass
+
 def getTravelTimes(lat,lon):
     """Return a set of travel times from the given lat, lon position.
     The return value is a json-able object, or an error message beginning
     with the string "error: "
     """
+    key = travelcache.key(lat,lon)
+    (result, fresh) = travelcache.lookup(key)
+    if result is not None:
+        if not fresh:
+            refresh(key,lat,lon)
+        return result
+    try:
+        return inflight.do((key, candidates(lat,lon)), lookupTravelTimes, key, lat, lon)
+    except Unavailable:
+        result = estimateTravelTimes(lat,lon)   # not cached
+        if result is None:
+            raise
+        return result
+
+def refresh(key, lat, lon):
+    """Update the cached travel times for key in the background"""
+    flightkey = (key, candidates(lat,lon))
+    if inflight.busy(flightkey):
+        return
+    def run():
+        try:
+            inflight.do(flightkey, lookupTravelTimes, key, lat, lon)
+        except Exception as e:
+            logging.warn("Background refresh of travel times failed: %s", repr(e))
+    if start_new_background_thread is not None:
+        start_new_background_thread(run, [])
+    else:
+        t = threading.Thread(target=run)
+        t.daemon = True
+        t.start()
+
+def lookupTravelTimes(key, lat, lon):
+    """Get the travel times from MapQuest, and cache them under key"""
+    result = fetchTravelTimes(lat,lon)
+    if not result.startswith("error"):
+        travelcache.put(key,result)
+    return result
+
+def candidates(lat,lon):
+    """Return the codes of the terminals close enough to ask MapQuest about"""
+    return tuple( term.code for term in WSF.Terminals if closeEnough(lat,lon,term.location) )
+
+def fetchTravelTimes(lat,lon):
+    """Compute the travel times from the given position by asking MapQuest"""
+    results = queryTravelTimes(lat,lon)
+    if results is None:
+        return "error: too far away to estimate."
+    return formatTimes(results)
+
+def estimateTravelTimes(lat,lon):
+    """Compute the travel times from the given position using the offline table.
+    Returns None if there is no table or the position is outside it"""
+    if drivetable is None:
+        return None
+    results = drivetable.lookup(lat,lon)
+    if results is None:
+        return None
+    logging.info("Estimated travel times from table for %s, %s", lat, lon)
+    return formatTimes( (WSF.terminal.lookup(code), minutes) for (code, minutes) in results )
+
+def formatTimes(results):
+    """Format a sequence of (terminal, minutes) the way the client expects"""
+    return "".join( "{}:{}\n".format(term.code, minutes) for (term, minutes) in results )
+
+def queryTravelTimes(lat,lon):
+    """Ask MapQuest for the travel times from the given position.
+    Returns a list of (terminal, minutes) for the terminals that make sense to drive to,
+    or None if the position is too far from any terminal."""
 
     ## Build the URL
     mqurl = 'http://mapquestapi.com/directions/v2/routematrix'
@@ -34,13 +140,13 @@ def getTravelTimes(lat,lon):
     for term in WSF.Terminals:
         if closeEnough(lat,lon,term.location):
             locs.append(mqformat(term.location))
-            keep.append(term.code)
+            keep.append(term)
         else:
             logging.debug("determined %s out of range", term.name)
 
     if len(keep) == 0:   # bail, nothing to do here
         logging.info("client too far away to estimate: %s, %s", lat, lon)
-        return "error: too far away to estimate.";
+        return None
 
     mqquery = json.dumps({"locations" : locs})
     mqrequest = mqurl + "?key=" + mqkey + "&json=" + urlencode(mqquery)
@@ -59,7 +165,7 @@ def getTravelTimes(lat,lon):
     except (KeyError, IndexError):
         logging.error("Mapquest reponse format unexpected")
         logging.error(json.dumps(mqresponse))
-        raise e
+        raise Unavailable("Mapquest reponse format unexpected")
 
 
     # if clientcounty == "":
@@ -82,9 +188,9 @@ def getTravelTimes(lat,lon):
 
 
     ## Extract the bits we want and build our own response from that
-    ourresponse = ""
+    ourresponse = []
     for i in range(0,len(keep)):
-        term = WSF.terminal.lookup(keep[i])
+        term = keep[i]
 
         # determine what is on the same side of the water:
         # generally we use counties to determine reachability, but there are a few special cases:
@@ -106,25 +212,54 @@ def getTravelTimes(lat,lon):
             continue
 
         #if we get here, we want to return this value.
-        ourresponse += "{}:{}\n".format(term.code, int(times[i+1]/60))
+        ourresponse.append( (term, int(times[i+1]/60)) )
 
     ## Return our response
     return ourresponse
 
+# How long our calls to MapQuest take (see Timing)
+upstream = Timing.histogram()
+
+if urlfetch is not None:
+    FetchErrors = (urllib2.URLError, socket.timeout, urlfetch.Error)
+else:
+    FetchErrors = (urllib2.URLError, socket.timeout)
+
 def fetchasjson(req):
     try:
-        stream = urllib2.urlopen(req)
-        body = stream.read()
-        return json.loads(body)
-    except urllib2.URLError as e:
-        logging.error("access to mapquest failed: " + e.reason)
+        body = guard.call(fetch, req)
+    except Breaker.Refused as e:
+        logging.warn("not calling mapquest: %s", e)
+        raise Refused("mapquest call refused: {}".format(e))
+    except FetchErrors as e:
+        logging.error("access to mapquest failed: %s", getattr(e, "reason", repr(e)))
         logging.error(req)
-        raise e;
+        raise Unavailable("access to mapquest failed")
+    try:
+        return json.loads(body)
     except ValueError as e:
         logging.error("error parsing mapquest response: " + repr(e))
         logging.error(body)
         # switch from ValueError as main interprets it differently
-        raise Exception("error parsing mapquest response");
+        raise Unavailable("error parsing mapquest response");
+
+def fetch(req):
+    """Return the body fetched from req, recording how long it took"""
+    start = time.time()
+    try:
+        return rawfetch(req)
+    finally:
+        upstream.add(time.time() - start)
+
+def rawfetch(req):
+    """Return the body fetched from req, giving up after Deadline seconds"""
+    if urlfetch is None:
+        return urllib2.urlopen(req, timeout=Deadline).read()
+    # this blocks the calling thread, but for no more than Deadline seconds
+    result = urlfetch.fetch(req, deadline=Deadline)
+    if result.status_code != 200:
+        raise urllib2.URLError("status {}".format(result.status_code))
+    return result.content
 
 
 def closeEnough(lat1,lon1,loc2):
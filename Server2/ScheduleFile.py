@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+import os
+import sys
+import glob
+import marshal
+from array import array
+from datetime import date
+
+"""
+Reading and writing compiled schedule files.
+"""
+# A schedule period is compiled (by Gatherer/compileschedule.py) into a single marshal'ed
+# tuple, so that loading it at startup is one read and one marshal.loads rather than
+# running a large python module:
+#   (format version, (year, month, day) of mindate, schedule name, entries)
+# where entries is a tuple of (route name, direction, dow, times) and times are the
+# departure minutes as packed little-endian uint16s.
+# Marshal is specific to the python version, so files must be written with python 2.7.
+
+FormatVersion = 1
+Directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "schedules")
+
+def filename(mindate):
+    """Return the path we store the schedule starting on mindate at"""
+    return os.path.join(Directory, "schedule_{:%Y_%m_%d}.dat".format(mindate))
+
+def allfiles():
+    """Return the paths of all the schedule files"""
+    return sorted(glob.glob(os.path.join(Directory, "schedule_*.dat")))
+
+def write(path, mindate, name, entries):
+    """Write a schedule file.  entries is a sequence of (route name, direction, dow, times)"""
+    packed = []
+    for (route, direction, dow, times) in entries:
+        times = array('H', times)
+        if sys.byteorder != 'little':
+            times.byteswap()
+        packed.append( (route, direction, dow, times.tostring()) )
+    data = marshal.dumps( (FormatVersion, (mindate.year, mindate.month, mindate.day), name, tuple(packed)) )
+    with open(path, "wb") as f:
+        f.write(data)
+
+def read(path):
+    """Read a schedule file, returning (mindate, name, entries), with the times of each entry as an array"""
+    with open(path, "rb") as f:
+        (version, mindate, name, packed) = marshal.loads(f.read())
+    if version != FormatVersion:
+        raise ValueError("{0} has format version {1}, expected {2}".format(path, version, FormatVersion))
+    entries = []
+    for (route, direction, dow, raw) in packed:
+        times = array('H')
+        times.fromstring(raw)
+        if sys.byteorder != 'little':
+            times.byteswap()
+        entries.append( (route, direction, dow, times) )
+    return (date(*mindate), name, entries)
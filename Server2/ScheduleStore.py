@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+from bisect import bisect_left
+import CurrentSchedule
+
+"""
+Indexed access to the current schedule.
+"""
+# A period's schedules are a flat tuple in the order the client expects to see it.
+# The store keeps that order (for building the text we send), and adds an index by
+# (route name, direction, dow) so that individual schedules can be found without a scan.
+# Each schedule's times are an array of increasing minutes, ready for bisect.
+
+class store(object):
+    """An index over one tuple of schedule objects"""
+    def __init__(self, source):
+        self.source = source             # the tuple this store was built from
+        self.entries = tuple(source)     # in original order
+        self.index = dict( ((x.name, x.direction, x.dow), x) for x in source )
+        # the Monday and Sunday schedules we send as the canonical weekday/weekend times
+        self.canonical = tuple( x for x in source if x.dow == 0 or x.dow == 6 )
+
+    def lookup(self, name, direction, dow):
+        """Return the schedule for this route, direction and day of week, or None"""
+        return self.index.get((name, direction, dow))
+
+    def after(self, name, direction, dow, minute, count):
+        """Return up to count departure times at or after minute, from one day's schedule"""
+        x = self.index.get((name, direction, dow))
+        if x is None:
+            return []
+        i = bisect_left(x.times, minute)
+        return x.times[i:i+count].tolist()
+
+
+_store = None
+
+def current():
+    """Return the store for the current schedule, rebuilding it if the schedule has been replaced"""
+    global _store
+    schedules = CurrentSchedule.activePeriod().schedules   # switches periods, if it is time
+    s = _store
+    if s is None or s.source is not schedules:
+        s = store(schedules)
+        _store = s
+    return s
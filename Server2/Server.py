@@ -1,54 +1,70 @@
 #!/usr/bin/env python
 import logging
 import webapp2
-from datetime import date
+from datetime import date, datetime
 import CurrentSchedule
 import CalcSchedule
+import InitCache
 import MapQuestTT
 import Alert
+import WSF
 import AdminUtils
+import Timing
+import pst
 
 class GetInitUpdate(webapp2.RequestHandler):
     """
     The client calls init to get whatever information it might need.
     Currently we send new schedules and/or alerts, as needed.
+    A client may add ?routes=<mask of route codes> to get only the alerts for those routes.
     """
     def get(self, clientversion, year=None, month=None, day=None):
         self.response.headers['Content-Type'] = 'text/plain'
         self.response.headers['Access-Control-Allow-Origin'] = '*'
         try:
-            if needschedule(year,month,day):
-                self.response.out.write('#schedule {:%Y.%m.%d}\n'.format(date.today()))
-                self.response.out.write(CalcSchedule.getSchedule(clientversion))
-                self.response.out.write('#name ' + CurrentSchedule.schedulename + '\n')
-
-            special = CalcSchedule.getSpecial(clientversion);
-            if special:
-                self.response.out.write('#special\n')
-                self.response.out.write(special)
-
-            if Alert.hasAlerts():
-                self.response.out.write('#allalerts\n')
-                for alert in Alert.allAlerts():
-                    self.response.out.write(str(alert))
-                self.response.out.write('__\n')
+            sections = InitCache.getSections(clientversion)
+            withschedule = needschedule(year,month,day)
+            alerts = Alert.currentSnapshot().forRoutes(WSF.clientMask(self.request.get('routes')))
+            gzipped = 'gzip' in self.request.accept_encoding
+
+            # The etag is computed from the pieces, so a client that already has this
+            # exact response costs us nothing more than a 304.
+            etag = sections.etag(withschedule, alerts.digest, gzipped)
+            self.response.headers['Vary'] = 'Accept-Encoding'
+            if etag in self.request.if_none_match:
+                self.response.etag = etag
+                self.response.status_int = 304
+                return
+
+            body = sections.body(withschedule, alerts)
+            if gzipped:
+                self.response.headers['Content-Encoding'] = 'gzip'
+                self.response.out.write(body.gzipped)
+            else:
+                self.response.out.write(body.plain)
+            self.response.etag = etag
         except:
             AdminUtils.handleError()
-        finally:
+            # don't send the terminator under headers meant for a gzipped or cached body
+            self.response.clear()
+            for header in ('Content-Encoding', 'ETag'):
+                if header in self.response.headers:
+                    del self.response.headers[header]
             self.response.out.write('#done\n')
 
 
 def needschedule(year,month,day):
     """
     Return true if the client needs a new version of the scheule.
-    The date passed in is the date the client received it's version.
-    If the version the client has is still good, return false
+    The date passed in is the date the client received it's version, which tells us which
+    schedule period it has.  If that is the period now in effect, return false
     Otherwise (including if the arguments are garbled or missing) return true
     """
     if year == None:
         return True
     try:
-        return date(int(year),int(month),int(day)) < CurrentSchedule.mindate
+        clientdate = date(int(year),int(month),int(day))
+        return CurrentSchedule.periodFor(clientdate) is not CurrentSchedule.activePeriod()
     except (ValueError, TypeError):
         logging.warn('Garbled data version caught: %s/%s/%s', year, month, day)
         return True
@@ -70,6 +86,32 @@ class GetTravelTimes(webapp2.RequestHandler):
             self.response.out.write(response)
         except (ValueError, TypeError):
             logging.error('GetTravelTime received bad args: %s, %s', lat, lon)
+        except MapQuestTT.Unavailable:
+            # no answer from MapQuest and nothing to fall back on; not worth an alarm
+            self.response.out.write('#traveltimes\nerror: travel times unavailable.\n')
+        finally:
+            self.response.out.write('#done\n')
+
+
+class GetNextDepartures(webapp2.RequestHandler):
+    """
+    Just the next few departures on one route, for clients (widgets, watches) that
+    don't want to download and scan the whole schedule.
+    The result is a list of times, in minutes past (Pacific) midnight today.
+    """
+    DefaultCount = 2
+    MaxCount = 10
+
+    def get(self, clientversion, route, direction):
+        self.response.headers['Content-Type'] = 'text/plain'
+        self.response.headers['Access-Control-Allow-Origin'] = '*'
+        try:
+            count = max(1, min(int(self.request.get('n', GetNextDepartures.DefaultCount)), GetNextDepartures.MaxCount))
+            times = CalcSchedule.getNext(clientversion, route, direction, datetime.now(pst.pacific), count)
+            self.response.out.write('#next\n')
+            self.response.out.write(",".join(map(str,times)) + '\n')
+        except (ValueError, TypeError):
+            logging.error('GetNextDepartures received bad args: %s, %s, %s', route, direction, self.request.get('n'))
         finally:
             self.response.out.write('#done\n')
 
@@ -84,6 +126,23 @@ class DailyCleanup(webapp2.RequestHandler):
     def get(self):
         Alert.dailyCleanup()
 
+class TravelCacheStats(webapp2.RequestHandler):
+    def get(self):
+        self.response.headers['Content-Type'] = 'text/plain'
+        self.response.out.write(MapQuestTT.travelcache.stats())
+        self.response.out.write(MapQuestTT.inflight.stats())
+        self.response.out.write(MapQuestTT.upstream.stats("mapquest"))
+        self.response.out.write(MapQuestTT.guard.stats())
+
+class Latency(webapp2.RequestHandler):
+    def get(self):
+        self.response.headers['Content-Type'] = 'text/plain'
+        self.response.out.write(AdminUtils.latencies())
+
+class Prewarm(webapp2.RequestHandler):
+    def get(self):
+        InitCache.prewarm()
+
 class DoStats(webapp2.RequestHandler):
     def get(self):
         AdminUtils.mailstats();
@@ -98,11 +157,16 @@ app = webapp2.WSGIApplication(debug=True)
 app.router.add((r'/init/(.{1,20}?)/(\d\d\d\d).(\d\d).(\d\d)', GetInitUpdate))
 app.router.add((r'/init/(.{1,20}?)/', GetInitUpdate))
 app.router.add((r'/traveltimes/(.{1,20}?)/([+-]?[\d.]+),([+-]?[\d.]+)', GetTravelTimes))
+app.router.add((r'/next/(.{1,20}?)/([a-z -]{1,30})/([ew])', GetNextDepartures))
 app.router.add((r'/_ah/mail/alert@nextferry.appspotmail.com', Alert.NewAlertHandler))
 app.router.add((r'/version',Version))
 app.router.add((r'/tasks/dailycleanup',DailyCleanup))
-app.router.add((r'/stats',DoStats))
+app.router.add((r'/tasks/prewarm',Prewarm))
+app.router.add((r'/tasks/ttstats',TravelCacheStats))
+app.router.add((r'/tasks/latency',Latency))
+app.router.add((r'/tasks/stats',DoStats))
 app.router.add((r'/_ah/start',Noop))  # silence gae errors
+app = Timing.middleware(app)
 
 if __name__ == '__main__':
     app.run()
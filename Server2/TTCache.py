@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+import math
+import time
+import threading
+from collections import OrderedDict
+
+"""
+Cache of travel time results, keyed by the grid cell containing the client's location,
+and coalescing of identical requests that are in progress at the same time.
+"""
+# Clients a few hundred yards apart get the same answer from MapQuest (to the minute, anyway),
+# so we snap locations to a grid and remember the answer for each cell for a while.
+# Entries expire after ttl seconds, but are kept (as stale) for maxstale seconds more, and
+# the least recently used entries are dropped once there are more than maxentries.
+
+GridSize = 0.005     # degrees; around here roughly 0.35 miles north-south, 0.25 miles east-west
+TTL = 10 * 60        # seconds
+MaxStale = 60 * 60   # seconds
+MaxEntries = 2000
+
+class cache(object):
+    def __init__(self, gridsize=GridSize, ttl=TTL, maxentries=MaxEntries, maxstale=MaxStale):
+        self.gridsize = gridsize
+        self.ttl = ttl
+        self.maxstale = maxstale
+        self.maxentries = maxentries
+        self.entries = OrderedDict()   # key -> (expiration time, value), least recently used first
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.stalehits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, lat, lon):
+        """Return the cache key (grid cell) for a location"""
+        return (int(math.floor(lat / self.gridsize)), int(math.floor(lon / self.gridsize)))
+
+    def get(self, key):
+        """Return the cached value for key, or None if it is missing or expired"""
+        (value, fresh) = self.lookup(key)
+        return value if fresh else None
+
+    def lookup(self, key):
+        """Return (value, fresh) for key, where fresh is False if the value has expired.
+        value is None if there is no entry, or it is too old to use at all."""
+        now = time.time()
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None or entry[0] + self.maxstale < now:
+                self.misses += 1
+                return (None, False)
+            self.entries[key] = entry    # now the most recently used
+            if entry[0] < now:
+                self.stalehits += 1
+                return (entry[1], False)
+            self.hits += 1
+            return (entry[1], True)
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (time.time() + self.ttl, value)
+            while len(self.entries) > self.maxentries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        """Return a printable summary of the cache counters"""
+        return "entries: {}\nhits: {}\nstale hits: {}\nmisses: {}\nevictions: {}\n".format(
+            len(self.entries), self.hits, self.stalehits, self.misses, self.evictions)
+
+
+# When a ferry unloads, dozens of phones at the same spot ask for travel times at once,
+# before any answer is in the cache.  Rather than each making its own MapQuest call,
+# the first caller for a key makes the call and the rest wait for its answer.
+
+WaitLimit = 15     # seconds a caller will wait for someone else's call before making its own
+
+class call(object):
+    """One call in progress"""
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class flights(object):
+    def __init__(self):
+        self.calls = {}     # key -> call in progress
+        self.lock = threading.Lock()
+        self.leaders = 0    # calls actually made
+        self.followers = 0  # callers that shared a call made by someone else
+
+    def do(self, key, fn, *args):
+        """Return fn(*args), sharing the result with any concurrent callers using the same key"""
+        with self.lock:
+            c = self.calls.get(key)
+            if c is None:
+                c = call()
+                self.calls[key] = c
+                self.leaders += 1
+                leader = True
+            else:
+                self.followers += 1
+                leader = False
+
+        if not leader:
+            if c.done.wait(WaitLimit):
+                if c.error is not None:
+                    raise c.error
+                return c.result
+            return fn(*args)   # gave up waiting
+
+        try:
+            c.result = fn(*args)
+            return c.result
+        except Exception as e:
+            c.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            c.done.set()
+
+    def busy(self, key):
+        """Return true if there is a call in progress for key"""
+        return key in self.calls
+
+    def stats(self):
+        """Return a printable summary of the counters"""
+        return "calls made: {}\ncalls shared: {}\n".format(self.leaders, self.followers)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+import time
+import threading
+from bisect import bisect_left
+
+"""
+Latency histograms: for each kind of request we serve, and for our calls to MapQuest.
+"""
+# Each histogram counts durations into fixed buckets (upper bounds in milliseconds, roughly
+# 1-2-5 per decade), so recording one is a bisect and an increment, and the memory used
+# doesn't grow with traffic.  Percentiles are interpolated within a bucket, which is plenty
+# accurate to tell whether a change made things faster.
+# The histograms cover everything since the instance started, or since the last reset
+# (the weekly stats mail resets them).
+
+Buckets = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)    # ms
+
+class histogram(object):
+    def __init__(self, buckets=Buckets):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counts = [0] * (len(self.buckets) + 1)    # the last counts everything slower
+            self.count = 0
+            self.total = 0.0
+            self.max = 0.0
+
+    def add(self, seconds):
+        ms = seconds * 1000.0
+        with self.lock:
+            self.counts[bisect_left(self.buckets, ms)] += 1
+            self.count += 1
+            self.total += ms
+            if ms > self.max:
+                self.max = ms
+
+    def percentile(self, p):
+        """Return an estimate of the p'th percentile of the durations, in ms"""
+        with self.lock:
+            counts = list(self.counts)
+            count = self.count
+            slowest = self.max
+        if count == 0:
+            return 0.0
+        target = count * p / 100.0
+        seen = 0
+        for (i, n) in enumerate(counts):
+            if n and seen + n >= target:
+                low = self.buckets[i-1] if i > 0 else 0
+                high = self.buckets[i] if i < len(self.buckets) else slowest
+                return min(low + (high - low) * (target - seen) / n, slowest)
+            seen += n
+        return slowest
+
+    def stats(self, name):
+        """Return a one line summary of the histogram"""
+        mean = self.total / self.count if self.count else 0.0
+        return "{}: n={} mean={:.1f} p50={:.1f} p95={:.1f} p99={:.1f} max={:.1f} ms\n".format(
+            name, self.count, mean, self.percentile(50), self.percentile(95), self.percentile(99), self.max)
+
+
+# Requests are grouped by the first part of their path; anything we don't expect goes in "other".
+Routes = ("init", "traveltimes", "next", "version", "mail", "tasks", "other")
+routes = dict( (r, histogram()) for r in Routes )
+
+def routeof(path):
+    """Return the name of the histogram for a request path"""
+    first = path.split("/", 2)[1] if path.startswith("/") else ""
+    if first == "_ah":
+        return "mail" if path.startswith("/_ah/mail/") else "tasks"
+    return first if first in routes else "other"
+
+class middleware(object):
+    """WSGI middleware recording the latency of each request to the wrapped app"""
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        start = time.time()
+        try:
+            return self.app(environ, start_response)
+        finally:
+            routes[routeof(environ.get("PATH_INFO", ""))].add(time.time() - start)
+
+    def __getattr__(self, name):
+        # so the wrapped app's router, run(), etc. are still reachable
+        return getattr(self.app, name)
+
+def stats():
+    """Return a printable summary of the request histograms"""
+    return "".join( routes[r].stats(r) for r in Routes )
+
+def reset():
+    for h in routes.values():
+        h.reset()
@@ -12,11 +12,10 @@ class terminal(object):
     @staticmethod
     def lookup(datum):
         """Return the terminal corresponding to the supplied datum (which may be name or code)."""
-        for term in Terminals:
-            if term.name == datum or term.code == datum:
-                return term
-        logging.warn("Attempted to look up a non-existent terminal field! " + repr(datum))
-        return None
+        term = TerminalIndex.get(datum)
+        if term is None:
+            logging.warn("Attempted to look up a non-existent terminal field! " + repr(datum))
+        return term
 
 Terminals = (
     terminal(1, "Anacortes", (48.502220,-122.679455), ("Whatcom", "Skagit", "Snohomish", "King")),
@@ -40,6 +39,9 @@ Terminals = (
     terminal(22, "Vashon Island", (47.508616,-122.464127), ("King"))
 )
 
+# Terminals by code and by name.  (Codes are ints and names are strings, so they can share.)
+TerminalIndex = dict( [(t.code, t) for t in Terminals] + [(t.name, t) for t in Terminals] )
+
 
 # Note: at some point we expect to be able to propagate route information
 # from server to client.  For now, since routes don't change, it hasn't been
@@ -63,11 +65,10 @@ class route(object):
     @staticmethod
     def lookup(datum):
         """look up a route by name or code"""
-        for route in Routes:
-            if datum in (route.code, route.dir1name, route.dir2name):
-                return route
-        logging.warn("Attempted to look up a non-existent route field! " + repr(datum))
-        return None
+        r = RouteIndex.get(datum)
+        if r is None:
+            logging.warn("Attempted to look up a non-existent route field! " + repr(datum))
+        return r
 
 
 Routes = (
@@ -83,7 +84,54 @@ Routes = (
     route(1<<10,'Anacortes','Friday Harbor','friday harbor','friday harbor'),
     route(1<<11,'Anacortes','Orcas Island','orcas','orcas')
 )
-AllRoutes = 1 | 1<<2 | 1<<3 | 1<<4 | 1<<5 | 1<<6 | 1<<7 | 1<<8 | 1<<9 | 1<<10 | 1<<10 | 1<<11
+
+# Routes by code and by both direction names.
+RouteIndex = dict( [(r.code, r) for r in Routes] +
+                   [(r.dir1name, r) for r in Routes] +
+                   [(r.dir2name, r) for r in Routes] )
+
+AllRoutes = reduce(lambda mask, r: mask | r.code, Routes, 0)
+
+
+# Route bitmasks.
+# A set of routes is represented as the OR of their codes; these are the conversions
+# between masks and the route names used in schedules.
+
+# all the (schedule) names of each route
+RouteNames = dict( (r.code, tuple(sorted(set([r.dir1name, r.dir2name])))) for r in Routes )
+
+def routeMask(names):
+    """Return the mask of the routes with the given names"""
+    mask = 0
+    for name in names:
+        mask |= RouteIndex[name].code
+    return mask
+
+_masknames = {}   # mask -> routeNames(mask), filled in as masks are seen
+
+def routeNames(mask):
+    """Return the names of all the routes in mask"""
+    mask &= AllRoutes
+    names = _masknames.get(mask)
+    if names is None:
+        names = tuple( name for r in Routes if mask & r.code for name in RouteNames[r.code] )
+        _masknames[mask] = names
+    return names
+
+def clientMask(text):
+    """Return the mask of the routes a client asked for (as a decimal mask),
+    or all of them if it didn't say or we can't make sense of it"""
+    if not text:
+        return AllRoutes
+    try:
+        mask = int(text)
+    except ValueError:
+        logging.warn('Garbled routes mask caught: %s', text)
+        return AllRoutes
+    if mask < 0 or not mask & AllRoutes:
+        logging.warn('Routes mask out of range: %s', text)
+        return AllRoutes
+    return mask & AllRoutes
 
 
 # this is text WSF uses to identify routes in alerts.
@@ -112,12 +160,10 @@ AlertStringCode = {
     "Override All Routes" : AllRoutes
 }
 
-
-
-
-
-
-
-
-
-
+def alertRoutes(text):
+    """Return the mask of the routes whose alert strings appear in text"""
+    mask = 0
+    for routestring, code in AlertStringCode.iteritems():
+        if routestring in text:
+            mask |= code
+    return mask
@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+#
+# Replay a real mix of client requests against Server.app, in process, and report
+# throughput, latency percentiles and retained objects for each kind of request.
+#
+# Requests come from Analyzer/stats.csv (the digested weekly stats mails): init, revisit
+# (init with the client's schedule date) and traveltimes, each with the client version
+# that made it.  The datastore, memcache and mail are the App Engine testbed stubs, and
+# MapQuest is replaced by a canned answer after --mqdelay milliseconds, so runs are
+# repeatable and make no outside calls.  Run it before and after a change:
+#
+#   python loadtest.py --sdk <path to google_appengine> [-n 5000] [--threads 4] [--alerts 3]
+#
+# (If you don't have the SDK installed, the appengine-sdk wheel on PyPI contains one, under
+# appengine_sdk/google_appengine.)
+#
+import os
+import gc
+import sys
+import csv
+import json
+import time
+import random
+import argparse
+import threading
+from wsgiref.util import setup_testing_defaults
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--sdk", help="where the App Engine SDK is, if it isn't already on the path")
+parser.add_argument("--csv", help="request log to replay",
+                    default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "Analyzer", "stats.csv"))
+parser.add_argument("-n", "--requests", type=int, default=0, help="number of requests to make (default: one pass over the log)")
+parser.add_argument("--threads", type=int, default=1, help="number of concurrent clients")
+parser.add_argument("--mqdelay", type=float, default=100, help="milliseconds each stub MapQuest call takes")
+parser.add_argument("--budget", action="store_true", help="apply the server's MapQuest budget (most travel times will be estimated)")
+parser.add_argument("--alerts", type=int, default=2, help="number of alerts to put in the datastore")
+parser.add_argument("--seed", type=int, default=1, help="seed for shuffling the requests")
+parser.add_argument("--ordered", action="store_true", help="replay in log order rather than shuffled")
+
+
+def setup(sdk):
+    """Put the SDK on the path and start the service stubs"""
+    if sdk:
+        sys.path.insert(0, sdk)
+        import dev_appserver
+        dev_appserver.fix_sys_path()
+    from google.appengine.ext import testbed
+    bed = testbed.Testbed()
+    bed.activate()
+    bed.init_datastore_v3_stub()
+    bed.init_memcache_stub()
+    bed.init_mail_stub()
+    return bed
+
+
+def stubmapquest(delay, budget):
+    """Replace the MapQuest call with a canned answer that takes delay ms"""
+    import MapQuestTT
+    import Breaker
+    if not budget:
+        MapQuestTT.guard = Breaker.breaker(rate=1e9, burst=1e9)
+    def fetch(req):
+        start = time.time()
+        time.sleep(delay / 1000.0)
+        MapQuestTT.upstream.add(time.time() - start)
+        return json.dumps({ "time": [0] + [ 1200 ] * 40,
+                            "locations": [ { "adminArea4": "King County", "adminArea5": "Seattle" } ] })
+    MapQuestTT.fetch = fetch
+    MapQuestTT.start_new_background_thread = None   # not available outside the runtime
+
+
+def addalerts(n):
+    import Alert
+    import WSF
+    import pst
+    from datetime import datetime, timedelta
+    for i in range(n):
+        Alert.Alert(body="Load test alert {}: vessel replacement on the {} route.".format(i, "bainbridge"),
+                    routes=WSF.routeMask(["bainbridge"]),
+                    expires=datetime.now(pst.utc) + timedelta(hours=2)).put()
+    Alert.alertsChanged()
+
+
+def readmix(path):
+    """Return the request paths in the log, in order"""
+    import CurrentSchedule
+    import pst
+    # a revisiting client has the current schedule, which is what usually happens
+    have = "{:%Y.%m.%d}".format(max(pst.today(), CurrentSchedule.activePeriod().mindate))
+    paths = []
+    with open(path) as f:
+        for row in csv.reader(f):
+            if len(row) < 9 or not row[5]:
+                continue
+            (kind, version, lat, lon) = (row[4], row[5], row[7].strip(), row[8].strip())
+            if kind == "init":
+                paths.append("/init/{}/".format(version))
+            elif kind == "revisit":
+                paths.append("/init/{}/{}".format(version, have))
+            elif kind == "traveltimes" and lat and lon:
+                paths.append("/traveltimes/{}/{},{}".format(version, lat, lon))
+    return paths
+
+
+class results(object):
+    """Per-route durations and status counts"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.durations = {}
+        self.errors = {}
+
+    def add(self, route, seconds, ok):
+        with self.lock:
+            self.durations.setdefault(route, []).append(seconds)
+            if not ok:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+
+def request(app, path):
+    """Make one request to app; return true if it succeeded"""
+    environ = {"PATH_INFO": path, "REQUEST_METHOD": "GET"}
+    setup_testing_defaults(environ)
+    status = []
+    def start_response(s, headers, exc_info=None):
+        status.append(s)
+    body = "".join(app(environ, start_response))
+    return status[0].startswith("200") and body.endswith("#done\n")
+
+
+def replay(app, paths, threads, out):
+    """Make the requests in paths using threads concurrent clients; return the elapsed time"""
+    import Timing
+    queue = list(reversed(paths))
+    lock = threading.Lock()
+    def client():
+        while True:
+            with lock:
+                if not queue:
+                    return
+                path = queue.pop()
+            start = time.time()
+            ok = request(app, path)
+            out.add(Timing.routeof(path), time.time() - start, ok)
+    workers = [ threading.Thread(target=client) for i in range(threads) ]
+    start = time.time()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return time.time() - start
+
+
+def retained(app, paths):
+    """Return the number of objects left behind per request for the paths, once warmed up"""
+    for path in paths[:10]:
+        request(app, path)
+    gc.collect()
+    before = len(gc.get_objects())
+    for path in paths:
+        request(app, path)
+    gc.collect()
+    return float(len(gc.get_objects()) - before) / len(paths)
+
+
+def percentile(times, p):
+    return times[min(len(times) - 1, int(len(times) * p / 100.0))] * 1000
+
+
+def report(out, elapsed, leftover):
+    """Print the results; req/s for a route is its share of the overall throughput"""
+    print "{:<12} {:>7} {:>7} {:>9} {:>8} {:>8} {:>8} {:>8} {:>9}".format(
+        "route", "count", "errors", "req/s", "p50 ms", "p95 ms", "p99 ms", "max ms", "objs/req")
+    total = 0
+    for route in sorted(out.durations):
+        times = sorted(out.durations[route])
+        total += len(times)
+        print "{:<12} {:>7} {:>7} {:>9.1f} {:>8.2f} {:>8.2f} {:>8.2f} {:>8.2f} {:>9.2f}".format(
+            route, len(times), out.errors.get(route, 0), len(times) / elapsed,
+            percentile(times, 50), percentile(times, 95), percentile(times, 99), times[-1] * 1000,
+            leftover.get(route, 0))
+    print "\n{} requests in {:.2f} s: {:.1f} req/s overall".format(total, elapsed, total / elapsed)
+
+
+def main():
+    args = parser.parse_args()
+    bed = setup(args.sdk)
+    try:
+        import Server
+        import Timing
+        import logging
+        logging.getLogger().setLevel(logging.ERROR)   # after the imports, since AdminUtils sets it
+        stubmapquest(args.mqdelay, args.budget)
+        addalerts(args.alerts)
+
+        paths = readmix(args.csv)
+        if not args.ordered:
+            random.Random(args.seed).shuffle(paths)
+        if args.requests:
+            paths = (paths * (args.requests // len(paths) + 1))[:args.requests]
+
+        out = results()
+        elapsed = replay(Server.app, paths, args.threads, out)
+
+        byroute = {}
+        for path in paths:
+            byroute.setdefault(Timing.routeof(path), []).append(path)
+        leftover = dict( (route, retained(Server.app, p[:500])) for (route, p) in byroute.items() )
+
+        report(out, elapsed, leftover)
+    finally:
+        bed.deactivate()
+
+if __name__ == '__main__':
+    main()
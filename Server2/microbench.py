@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+#
+# Time the functions on the request path (and the schedule page parser) on full size inputs,
+# and compare with the times recorded in microbench.json.
+#
+#   python microbench.py            # fails (exit 1) if anything is more than --threshold slower
+#   python microbench.py --save     # record the current times as the baseline
+#
+# The schedules are the current compiled schedule, and the pages are Gatherer/corpus.
+# Each benchmark is compared relative to a calibration loop timed right alongside it, which
+# takes out most of the machine's speed and load, so a baseline recorded on one machine is
+# roughly usable on another.  Re-save the baseline after a deliberate change.
+# Nothing here needs App Engine.
+#
+import os
+import sys
+import json
+import timeit
+import logging
+import argparse
+from datetime import date
+import ScheduleStore
+import CalcSchedule
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(here, "..", "Gatherer"))
+import fetchpages
+import benchparse
+
+BaselinePath = os.path.join(here, "microbench.json")
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--save", action="store_true", help="record the results as the new baseline")
+parser.add_argument("--threshold", type=float, default=0.4, help="fraction slower than the baseline that counts as a regression")
+parser.add_argument("--only", help="run only the benchmarks whose names contain this")
+
+
+def calibrate():
+    total = 0
+    for i in xrange(1000):
+        total += i * i
+    return total
+
+def benchmarks():
+    """Return a list of (name, function of no arguments)"""
+    store = ScheduleStore.current()
+    canonical = store.canonical
+    special = [ x for x in store.entries if x.dow == 2 ]
+    v4canonical = CalcSchedule.versionify(canonical, "4.0")
+    pages = [ text for (name, text, expected) in benchparse.loadcorpus() ]
+    bigpage = max(pages, key=len)
+    wednesday = date(2017, 8, 2)
+    return [
+        ("textify canonical",       lambda: CalcSchedule.textify(v4canonical, True)),
+        ("textify special",         lambda: CalcSchedule.textify(special, False)),
+        ("versionify 1.0",          lambda: CalcSchedule.versionify(canonical, "1.0")),
+        ("versionify 2.0",          lambda: CalcSchedule.versionify(canonical, "2.0")),
+        ("versionify 4.0",          lambda: CalcSchedule.versionify(canonical, "4.0")),
+        ("v2interpolate",           lambda: CalcSchedule.v2interpolate(canonical)),
+        ("v4plus",                  lambda: CalcSchedule.v4plus(canonical)),
+        ("getSchedule 2.0",         lambda: CalcSchedule.getSchedule("2.0")),
+        ("getSchedule 4.0",         lambda: CalcSchedule.getSchedule("4.0")),
+        ("getSpecial 4.0",          lambda: CalcSchedule.getSpecial("4.0", wednesday)),
+        ("fetchpages.parse",        lambda: fetchpages.parse(bigpage)),
+        ("fetchpages.parse corpus", lambda: [ fetchpages.parse(p) for p in pages ]),
+    ]
+
+
+def measure(fn):
+    """Return the best time for one call of fn, in microseconds"""
+    number = 1
+    while min(timeit.repeat(fn, number=number, repeat=1)) < 0.05:
+        number *= 2
+    return min(timeit.repeat(fn, number=number, repeat=5)) / number * 1e6
+
+def relative(fn):
+    """Return (usec per call of fn, usec per call of the calibration loop), interleaved"""
+    usec = []
+    calibration = []
+    for i in range(3):
+        calibration.append(measure(calibrate))
+        usec.append(measure(fn))
+    return (min(usec), min(calibration))
+
+
+def main():
+    args = parser.parse_args()
+    if args.save and args.only:
+        parser.error("--save records every benchmark, so can't be used with --only")
+    fetchpages.logger.setLevel(logging.ERROR)
+    baseline = {}
+    if os.path.exists(BaselinePath):
+        with open(BaselinePath) as f:
+            baseline = json.load(f)
+
+    results = {}
+    regressions = []
+    print "{:<26} {:>10} {:>10} {:>8}".format("benchmark", "usec", "baseline", "change")
+    for (name, fn) in benchmarks():
+        if args.only and args.only not in name:
+            continue
+        (usec, calibration) = relative(fn)
+        results[name] = [usec, calibration]
+        if name in baseline:
+            (baseusec, basecalibration) = baseline[name]
+            expected = baseusec * calibration / basecalibration
+            change = usec / expected - 1
+            flag = "  REGRESSION" if change > args.threshold else ""
+            if flag:
+                regressions.append(name)
+            print "{:<26} {:>10.2f} {:>10.2f} {:>+7.0%}{}".format(name, usec, expected, change, flag)
+        else:
+            print "{:<26} {:>10.2f} {:>10} {:>8}".format(name, usec, "-", "")
+
+    if args.save:
+        with open(BaselinePath, "w") as f:
+            json.dump(results, f, indent=1, sort_keys=True, separators=(",", ": "))
+            f.write("\n")
+        print "Saved baseline to", BaselinePath
+    elif regressions:
+        print "{} regression(s): {}".format(len(regressions), ", ".join(regressions))
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -46,6 +46,10 @@ def toPacific(dt):
         dt = dt.replace(tzinfo=utc)
     return dt.astimezone(pacific)
 
+def today():
+    """return the current date in pacific time"""
+    return dtm.datetime.now(pacific).date()
+
 def toUTC(dt):
     """convert time to UTC, interpreting naive times as pacific"""
     if dt.tzinfo == None:
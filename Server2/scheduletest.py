@@ -1,5 +1,30 @@
+from datetime import date, datetime
 import CurrentSchedule
 import CalcSchedule
+import InitCache
+import ScheduleStore
+import TTCache
+import Breaker
+import Timing
+import DriveTable
+import WSF
+import pst
+import os
+import gzip
+import tempfile
+import StringIO
+import collections
+import time
+import threading
+import datetime as dt
+try:
+	# the alert tests need the App Engine SDK on PYTHONPATH
+	import dev_appserver
+	dev_appserver.fix_sys_path()
+	from google.appengine.ext import testbed
+	import Alert
+except ImportError:
+	testbed = None
 
 # I tried using unittest, wasn't working probably due to python version issues.
 # rather than debug, just manually hack together sufficient for now
@@ -54,8 +79,20 @@ edmonds,ee,1090,1140
 def main():
 	test_textify()
 	test_versionify()
+	test_versions()
 	test_canonical()
+	test_store()
+	test_next()
 	test_special()
+	test_initcache()
+	test_etags()
+	test_bodies()
+	test_travelcache()
+	test_flights()
+	test_breaker()
+	test_timing()
+	test_drivetable()
+	test_alerts()
 
 def test_textify():
 	result = CalcSchedule.textify(smallist,True)
@@ -71,17 +108,297 @@ def test_versionify():
 	assert result=="vashon-pt defiance,es,380,430\npt defiance-vashon,ws,305,355\n", "Checking pt defiance turn-around"
 	print "test_versionify passed"
 
+def test_versions():
+	assert CalcSchedule.parseVersion("4.2") == (4,2), "Checking version parsing"
+	assert CalcSchedule.parseVersion("v3") == (3,0), "Checking version parsing without minor version"
+	assert CalcSchedule.parseVersion("4.x") is None, "Checking unparseable version"
+	assert [ CalcSchedule.versionBucket(v) for v in ("1.0","2.0","3.0","v3.0","4.0","4.3","junk") ] == ["1.0","2.0","1.0","1.0","4.0","4.0","4.0"], "Checking version buckets"
+	CurrentSchedule.replaceForTest(ptdeflist)
+	assert CalcSchedule.view("4.2").lookup('vashon-pt defiance','e',6).times.tolist() == [380,430], "Checking v4 view"
+	assert CalcSchedule.view("3.0").lookup('vashon-pt defiance','w',6).times.tolist() == [380,430], "Checking v3 view"
+	assert CalcSchedule.view("4.0") is CalcSchedule.view("4.3"), "Checking views are shared"
+	result = CalcSchedule.getNext("4.0", 'vashon-pt defiance', 'e', datetime(2017,7,9,6,0), 2)
+	assert result == [380,430], "Checking next departures with the v4 direction"
+	CurrentSchedule.replaceForTest(biglist)
+	result = CalcSchedule.getNext("2.0", 'bainbridge', 'w', datetime(2017,7,5,3,10), 3)
+	assert result == [575,640], "Checking v2 next departures don't include the dummy times"
+	assert CalcSchedule.getSchedule("2.0").startswith("bainbridge,wd,200,201,"), "Checking v2 schedule still has the dummy times"
+	CurrentSchedule.replaceForTest(biglist)
+	print "test_versions passed"
+
 def test_canonical():
-	CurrentSchedule.CurrentSchedule = biglist # DANGER, DESTRUCTIVE, DO NOT TRY THIS AT HOME
+	CurrentSchedule.replaceForTest(biglist) # DANGER, DESTRUCTIVE, DO NOT TRY THIS AT HOME
 	result = CalcSchedule.getSchedule("3.0")
 	assert result == canonicalresult, "Checking canonical result"
 	print "test_canonical passed"
 
+def test_store():
+	CurrentSchedule.replaceForTest(biglist)
+	store = ScheduleStore.current()
+	assert store.lookup('edmonds','e',3).text == '625,675,715,770', "Checking store lookup"
+	assert store.lookup('edmonds','e',7) is None, "Checking store lookup of missing schedule"
+	assert list(store.lookup('bainbridge','w',5).times) == [900,945,1000], "Checking store times"
+	CurrentSchedule.replaceForTest(smallist)
+	assert ScheduleStore.current().lookup('edmonds','e',3) is None, "Checking store follows schedule change"
+	CurrentSchedule.replaceForTest(biglist)
+	print "test_store passed"
+
+def test_next():
+	CurrentSchedule.replaceForTest(biglist)
+	result = CalcSchedule.getNext("3.0", 'bainbridge', 'w', datetime(2017,7,5,9,0), 2)
+	assert result == [575,640], "Checking next departures"
+	result = CalcSchedule.getNext("3.0", 'bainbridge', 'w', datetime(2017,7,5,9,35), 5)
+	assert result == [575,640], "Checking next departures includes a departure right now"
+	for count in (0, -3):
+		result = CalcSchedule.getNext("3.0", 'bainbridge', 'w', datetime(2017,7,5,9,0), count)
+		assert result == [], "Checking next departures with a count below one"
+	result = CalcSchedule.getNext("3.0", 'bainbridge', 'w', datetime(2017,7,4,16,40), 2)
+	assert result == [1000,1050], "Checking next departures on a holiday"
+	CurrentSchedule.replaceForTest((
+		CurrentSchedule.schedule('bainbridge','w',0,'1380,1450,1500'),
+		CurrentSchedule.schedule('bainbridge','w',1,'330,370')))
+	result = CalcSchedule.getNext("3.0", 'bainbridge', 'w', datetime(2017,7,11,0,20), 2)
+	assert result == [60,330], "Checking next departures after midnight"
+	CurrentSchedule.replaceForTest(biglist)
+	print "test_next passed"
+
 def test_special():
-	# we really need mocks to test this.  hand tested by setting today to be holiday in CurrentSchedule.py
-    #CurrentSchedule.CurrentSchedule = biglist
-    #print CalcSchedule.getSpecial("3.0")
-    print "test_special not implemented"
+	CurrentSchedule.replaceForTest(biglist)
+	result = CalcSchedule.getSpecial("3.0", date(2017,7,5))
+	assert result == "bainbridge,ws,575,640\nbainbridge,es,525,580,625\nedmonds,ws,630,670\nedmonds,es,475,520,580\n", "Checking special schedule"
+	result = CalcSchedule.getSpecial("3.0", date(2017,7,4))
+	assert result == "bainbridge,ws,1000,1050,1100\nbainbridge,es,995,1050,1110\nedmonds,ws,1005,1045\nedmonds,es,1090,1140\n", "Checking holiday schedule"
+	print "test_special passed"
+
+def test_initcache():
+	first = InitCache.getSections("3.0")
+	assert InitCache.getSections("1.0") is first, "Checking versions with the same schedule share a cache entry"
+	assert InitCache.getSections("2.0") is not first, "Checking v2 gets its own cache entry"
+	assert first.schedule == '#schedule {:%Y.%m.%d}\n'.format(pst.today()) + CalcSchedule.getSchedule("3.0") + \
+		'#name ' + CurrentSchedule.activePeriod().name + '\n', "Checking cached schedule section"
+	print "test_initcache passed"
+
+def test_etags():
+	CurrentSchedule.replaceForTest(biglist)
+	wednesday = InitCache.build("4.0", date(2017,7,5))
+	again = InitCache.build("4.0", date(2017,7,5))
+	saturday = InitCache.build("4.0", date(2017,7,8))
+	assert wednesday.etag(True, "a1") != wednesday.etag(False, "a1"), "Checking etag differs with and without the schedule"
+	assert wednesday.etag(True, "a1") != wednesday.etag(True, "a2"), "Checking etag changes with the alerts"
+	assert wednesday.etag(False, "a1") != saturday.etag(False, "a1"), "Checking etag changes with the special section"
+	assert wednesday.etag(True, "a1") == again.etag(True, "a1") and wednesday.etag(False, "a1") == again.etag(False, "a1"), \
+		"Checking etag is stable for identical content"
+	assert wednesday.etag(True, "a1", True) == wednesday.etag(True, "a1") + "-gz", "Checking the gzipped response has its own etag"
+	print "test_etags passed"
+
+def test_bodies():
+	CurrentSchedule.replaceForTest(biglist)
+	sections = InitCache.build("4.0", date(2017,7,5))
+	selection = collections.namedtuple("selection", "text digest")
+	a1 = selection("#alert one\n", "a1")
+	a2 = selection("#alert two\n", "a2")
+	body = sections.body(True, a1)
+	assert body.plain == sections.schedule + sections.special + a1.text + "#done\n", "Checking the complete response"
+	assert gzip.GzipFile(fileobj=StringIO.StringIO(body.gzipped)).read() == body.plain, "Checking the gzipped response"
+	assert sections.body(True, selection("#alert one\n", "a1")) is body, "Checking responses are cached by alerts digest"
+	assert sections.body(False, a1) is not body, "Checking responses are cached with and without the schedule"
+	assert sections.body(False, a1).plain == sections.special + a1.text + "#done\n", "Checking the response without the schedule"
+	assert sections.body(True, a2) is not body and sections.body(True, a2).plain.endswith(a2.text + "#done\n"), \
+		"Checking responses with other alerts"
+	assert sorted(sections.bodies) == [(False, "a1"), (True, "a1"), (True, "a2")], "Checking the cache keys"
+	print "test_bodies passed"
+
+def test_travelcache():
+	cache = TTCache.cache(ttl=0.05, maxstale=0.1)
+	key = cache.key(47.6, -122.33)
+	assert key == cache.key(47.6001, -122.3299), "Checking nearby locations share a key"
+	cache.put(key, "7:12\n")
+	assert cache.lookup(key) == ("7:12\n", True), "Checking fresh entry"
+	time.sleep(0.06)
+	assert cache.lookup(key) == ("7:12\n", False), "Checking expired entry is returned as stale"
+	assert cache.get(key) is None, "Checking get ignores stale entries"
+	time.sleep(0.1)
+	assert cache.lookup(key) == (None, False), "Checking entry too old to use"
+	print "test_travelcache passed"
+
+def test_flights():
+	flights = TTCache.flights()
+	release = threading.Event()
+	calls = []
+	def fn(x):
+		calls.append(x)
+		release.wait(5)
+		return x * 2
+	results = []
+	threads = [ threading.Thread(target=lambda: results.append(flights.do("k", fn, 21))) for i in range(5) ]
+	for t in threads:
+		t.start()
+	for i in range(500):
+		if flights.followers == 4:
+			break
+		time.sleep(0.01)
+	assert flights.busy("k"), "Checking the call is in progress"
+	release.set()
+	for t in threads:
+		t.join()
+	assert calls == [21] and results == [42] * 5, "Checking concurrent callers share one call"
+	assert (flights.leaders, flights.followers) == (1, 4), "Checking single flight counters"
+	assert not flights.busy("k"), "Checking the call is finished"
+	def fail():
+		raise ValueError("no")
+	try:
+		flights.do("k", fail)
+		assert False, "Checking errors are raised"
+	except ValueError:
+		pass
+	print "test_flights passed"
+
+def test_breaker():
+	def ok():
+		return "ok"
+	def bad():
+		raise IOError("down")
+	def refused(b, fn):
+		try:
+			b.call(fn)
+			return False
+		except Breaker.Refused:
+			return True
+
+	assert abs(Breaker.Rate * 30 * 24 * 3600 - Breaker.Quota) < 1, "Checking the budget spends the monthly quota"
+	b = Breaker.breaker(rate=0, burst=2)
+	assert b.call(ok) == "ok" and b.call(ok) == "ok", "Checking calls within the budget"
+	assert refused(b, ok) and b.shed == 1, "Checking calls over the budget are shed"
+
+	b = Breaker.breaker(rate=1000, burst=1000, failures=2, cooldown=0.05)
+	for i in range(2):
+		try:
+			b.call(bad)
+		except IOError:
+			pass
+	assert b.state == Breaker.Open, "Checking the breaker opens after consecutive failures"
+	assert refused(b, ok) and b.shortcircuited == 1, "Checking calls are short-circuited while open"
+	time.sleep(0.06)
+	assert b.admit() is True, "Checking the first call after the cooldown is a probe"
+	assert refused(b, ok), "Checking only one probe at a time"
+	b.finished(True, False)
+	assert b.state == Breaker.Open and refused(b, ok), "Checking a failed probe reopens the breaker"
+	time.sleep(0.06)
+	assert b.call(ok) == "ok" and b.state == Breaker.Closed, "Checking a successful probe closes the breaker"
+	assert b.call(ok) == "ok" and b.trips == 2, "Checking calls go through once closed"
+	print "test_breaker passed"
+
+def test_timing():
+	h = Timing.histogram()
+	assert h.percentile(50) == 0.0, "Checking an empty histogram"
+	for ms in range(1, 101):
+		h.add(ms / 1000.0)
+	assert (h.count, h.max) == (100, 100.0), "Checking the histogram counts"
+	assert abs(h.percentile(50) - 50) < 0.5 and abs(h.percentile(99) - 99) < 0.5, "Checking percentiles are interpolated within a bucket"
+	assert abs(h.percentile(25) - 25) < 0.5, "Checking a percentile in a lower bucket"
+	h.reset()
+	h.add(20.0)
+	h.add(30.0)
+	assert h.percentile(50) == 20000.0, "Checking the overflow bucket interpolates up to the slowest"
+	assert h.percentile(100) == 30000.0, "Checking the overflow bucket is capped by the slowest"
+	h.reset()
+	h.add(0.0004)
+	assert h.percentile(100) == 0.4, "Checking percentiles are capped by the slowest"
+	routes = [ Timing.routeof(path) for path in ("/init/4.0/", "/init/4.0/2017.07.05", "/traveltimes/4.0/47.6,-122.3",
+		"/next/4.0/bainbridge/w", "/version", "/_ah/mail/stats@x.appspotmail.com", "/_ah/warmup", "/tasks/stats", "/", "/favicon.ico", "") ]
+	assert routes == ["init", "init", "traveltimes", "next", "version", "mail", "tasks", "tasks", "other", "other", "other"], \
+		"Checking requests are grouped by route"
+	assert sorted(set(routes)) == sorted(Timing.Routes), "Checking every route is covered"
+	print "test_timing passed"
+
+def test_drivetable():
+	M = DriveTable.Missing
+	# 3x3 grid, two terminals; terminal 2 can't be reached from the top middle point
+	cells = ((10,5), (20,M), (30,7),
+		(40,8), (50,9), (60,10),
+		(70,11), (80,12), (90,13))
+	(fd, path) = tempfile.mkstemp(suffix=".dat")
+	os.close(fd)
+	try:
+		DriveTable.write(path, 47.0, -122.5, 0.125, 3, 3, (1, 2), cells)
+		table = DriveTable.load(path)
+		assert (table.nlat, table.nlon, table.codes) == (3, 3, (1, 2)), "Checking the table header"
+		assert table.lookup(47.0, -122.5) == [(1,10), (2,5)], "Checking a grid point"
+		result = table.lookup(47.0 + 1.25*0.125, -122.5 + 1.25*0.125)
+		assert result == [(1,60), (2,10)], "Checking interpolation inside the grid"
+		result = table.lookup(47.0 + 0.25*0.125, -122.5 + 0.25*0.125)
+		assert result == [(1,20), (2,5)], "Checking the nearest value is used next to a missing one"
+		result = table.lookup(47.0 + 0.25*0.125, -122.5 + 0.75*0.125)
+		assert result == [(1,25)], "Checking a terminal missing at the nearest point is left out"
+		for (lat, lon) in ((46.99, -122.4), (47.3, -122.4), (47.1, -122.51), (47.1, -122.2)):
+			assert table.lookup(lat, lon) is None, "Checking positions outside the grid"
+	finally:
+		os.remove(path)
+	assert DriveTable.load(path) is None, "Checking a missing table"
+	print "test_drivetable passed"
+
+def test_alerts():
+	everything = WSF.AllRoutes
+	for text in ("", None, "bainbridge", "1.5", "-1", "0", str(1 << 20)):
+		assert WSF.clientMask(text) == everything, "Checking an unusable routes mask asks for everything: %r" % text
+	assert WSF.clientMask("5") == 5 and WSF.clientMask(str(5 | 1 << 20)) == 5, "Checking routes masks"
+	if testbed is None:
+		print "test_alerts skipped (no App Engine SDK)"
+		return
+	bed = testbed.Testbed()
+	bed.activate()
+	bed.init_datastore_v3_stub()
+	bed.init_memcache_stub()
+	try:
+		now = dt.datetime.now(pst.utc)
+		def alert(body, expires, routes=1):
+			a = Alert.Alert(body=body, routes=routes, expires=expires)
+			a.put()
+			return a
+		for i in range(10):
+			alert("old %d" % i, now - dt.timedelta(hours=1))
+		soon = alert("soon", now + dt.timedelta(seconds=1))
+		later = alert("later", now + dt.timedelta(hours=1))
+		live = list(Alert.allAlerts())
+		assert sorted( a.body for a in live ) == ["later", "soon"], "Checking expired alerts don't crowd out live ones"
+
+		s = Alert.currentSnapshot()
+		assert "soon" in s.text and "later" in s.text, "Checking snapshot has the live alerts"
+		assert Alert.currentSnapshot() is s, "Checking snapshot is reused"
+		time.sleep(1.1)
+		t = Alert.currentSnapshot()
+		assert t is not s and "soon" not in t.text and "later" in t.text, "Checking an expired alert is dropped right away"
+		assert t.digest != s.digest, "Checking the digest changes when an alert expires"
+		assert Alert.currentSnapshot() is t, "Checking the new snapshot is reused"
+
+		Alert.dailyCleanup()
+		assert sorted( a.body for a in Alert.Alert.all() ) == ["later"], "Checking cleanup deletes the expired alerts"
+
+		bainbridge = WSF.routeMask(["bainbridge"])
+		edmonds = WSF.routeMask(["edmonds"])
+		mukilteo = WSF.routeMask(["mukilteo"])
+		alert("edmonds only", now + dt.timedelta(hours=1), edmonds)
+		alert("all routes", now + dt.timedelta(hours=1), everything)
+		Alert.alertsChanged()
+		s = Alert.currentSnapshot()
+		mine = s.forRoutes(bainbridge)
+		assert "later" in mine.text and "all routes" in mine.text and "edmonds only" not in mine.text, \
+			"Checking a mask selects its alerts and the ones for all routes"
+		assert "edmonds only" in s.forRoutes(everything).text and s.forRoutes(everything).digest == s.digest, \
+			"Checking the all routes mask selects everything"
+		assert s.forRoutes(mukilteo).text.count("__ ") == 1, "Checking a route without its own alerts still gets the all routes one"
+		same = s.forRoutes(bainbridge | mukilteo)
+		assert same is not mine and (same.digest, same.text) == (mine.digest, mine.text), \
+			"Checking masks selecting the same alerts share a digest"
+		assert s.forRoutes(bainbridge) is mine, "Checking selections are kept"
+		for mask in range(1, Alert.MaxSelections + 2):
+			s.forRoutes(mask << 1)
+		assert len(s.selections) <= Alert.MaxSelections, "Checking the selections are limited"
+		assert s.selections[everything].digest == s.digest and s.forRoutes(everything).text == s.text, \
+			"Checking the all routes selection survives the reset"
+	finally:
+		bed.deactivate()
+	print "test_alerts passed"
 
 if __name__ == "__main__":
 	main()